@@ -10,7 +10,6 @@ def _():
     import polars as pl
     import numpy as np
     import seaborn as sns
-    import hdmedians as hdm
 
     import rmsd_map
     from rmsd_map.mol_io.cor_reader import read_cor_file
@@ -18,50 +17,41 @@ def _():
     from rmsd_map.rmsd.pipelines import align_fragments, chain_fragments_naive, chain_fragments, partial_align_fragments
 
     from vis import ChooseLineWidget, sort_along
+    from clusters import representative_points
+    from umaps import scan_umaps
     return (
         ChooseLineWidget,
         Fragment,
         align_fragments,
         chain_fragments,
-        hdm,
         mo,
         np,
         partial_align_fragments,
         pl,
         read_cor_file,
+        representative_points,
+        scan_umaps,
         sns,
         sort_along,
     )
 
 
 @app.cell
-def _(np, pl, read_cor_file):
+def _(np, read_cor_file, scan_umaps):
     # Reading files
 
     cor = read_cor_file("./acids_rwp5_all_noh.cor")
     cor = np.asarray(cor, dtype=object)
-    um = pl.read_csv("./acids_rwp5_all_noh_umaps.csv") # Vanilla UMAP
-    ud = pl.read_csv("./acids_rwp5_all_noh_umaps_d.csv") # Denity-preserving UMAP with UMAP(densmap=True)
+    um = scan_umaps("./acids_rwp5_all_noh_umaps") # Vanilla UMAP
+    ud = scan_umaps("./acids_rwp5_all_noh_umaps_d") # Denity-preserving UMAP with UMAP(densmap=True)
     return cor, ud
 
 
-@app.cell
-def _(hdm, np, pl):
-    # stupid central point chooser
-
-    def representative_point_idx(df):
-        points = df.select(pl.col("X", "Y")).to_numpy()
-        median = hdm.geomedian(points, axis = 0)
-        dists = np.linalg.norm(points - median, axis=1)
-        return np.argmin(dists)
-    return (representative_point_idx,)
-
-
 @app.cell
 def _(pl, sns, ud):
     # Chose umap/distmap and N neighbors
 
-    df = ud.filter(pl.col("N") == 40)
+    df = ud.filter(pl.col("N") == 40).collect()
     sns.scatterplot(data = df , x="X", y="Y")
     return (df,)
 
@@ -79,11 +69,11 @@ def _(df, pl, sns):
 
 
 @app.cell
-def _(Fragment, align_fragments, cor, df2, mo, pl, representative_point_idx):
+def _(Fragment, align_fragments, cor, df2, mo, representative_points):
     # CLuster 1
 
     clu1 = cor[df2["label"] == 2]
-    clu1_center_idx = representative_point_idx(df2.filter(pl.col("label") == 1) )
+    clu1_center_idx = representative_points(df2)[1]
     clu1_aligned = align_fragments(clu1, clu1_center_idx)
 
     clu1_view = Fragment.plot_fragments(clu1_aligned)
@@ -152,11 +142,11 @@ def _(Fragment, clu1_chain, mo, np, partial_align_fragments, sns):
 
 
 @app.cell
-def _(Fragment, align_fragments, cor, df2, mo, pl, representative_point_idx):
+def _(Fragment, align_fragments, cor, df2, mo, representative_points):
     # CLuster 3
 
     clu3 = cor[df2["label"] == 3]
-    clu3_center_idx = representative_point_idx(df2.filter(pl.col("label") == 3) )
+    clu3_center_idx = representative_points(df2)[3]
     clu3_aligned = align_fragments(clu3, clu3_center_idx)
 
     clu3_view = Fragment.plot_fragments(clu3_aligned)
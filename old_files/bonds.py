@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import re
+
+import numpy as np
+
+# Single-bond covalent radii in angstrom (Cordero et al., 2008)
+COVALENT_RADII = {
+    "H": 0.31, "B": 0.84, "C": 0.76, "N": 0.71, "O": 0.66, "F": 0.57,
+    "Si": 1.11, "P": 1.07, "S": 1.05, "Cl": 1.02, "Se": 1.20, "Br": 1.20,
+    "Te": 1.38, "I": 1.39,
+}
+
+_SYMBOL = re.compile(r"[A-Z][a-z]?")
+
+
+def element_symbol(label):
+    """Element symbol of a .cor atom label, e.g. ``"Cl2"`` -> ``"Cl"``, ``"C11%"`` -> ``"C"``."""
+    match = _SYMBOL.match(label)
+    if match is None:
+        raise ValueError(f"Can't parse element from atom label {label!r}")
+    symbol = match.group()
+    # Labels such as "CL1" or "Cb" without a known two-letter element
+    if len(symbol) == 2 and symbol not in COVALENT_RADII:
+        symbol = symbol[0]
+    return symbol
+
+
+def _pair_bonds(coords, symbols, pair, tolerance):
+    """
+    Bonds between elements ``pair[0]`` and ``pair[1]`` for a stack of
+    fragments sharing the same atom symbols.
+
+    coords is (n_fragments, n_atoms, 3); returns one flat index array per
+    fragment, [a1, b1, a2, b2, ...] sorted by the first atom.
+    """
+    symbols = np.asarray(symbols)
+    a_idx = np.flatnonzero(symbols == pair[0])
+    b_idx = np.flatnonzero(symbols == pair[1])
+    empty = np.zeros(0, dtype=int)
+    if len(a_idx) == 0 or len(b_idx) == 0:
+        return [empty] * len(coords)
+
+    cutoff = COVALENT_RADII[pair[0]] + COVALENT_RADII[pair[1]] + tolerance
+    diff = coords[:, a_idx, None, :] - coords[:, None, b_idx, :]
+    bonded = np.einsum("fabk,fabk->fab", diff, diff) <= cutoff ** 2
+    if pair[0] == pair[1]:
+        # Count each homonuclear bond once and never an atom with itself
+        bonded &= a_idx[:, None] < b_idx[None, :]
+
+    result = []
+    for mask in bonded:
+        ia, ib = np.nonzero(mask)
+        result.append(np.column_stack([a_idx[ia], b_idx[ib]]).ravel().astype(int))
+    return result
+
+
+def source_key(path, chunk_size=1 << 20):
+    """
+    Cache namespace of a .cor file: a digest of its contents.
+
+    Fragment ids like ``REFCODE_1`` repeat across searches with different
+    atoms, so cached bonds are kept per source file.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class BondCache:
+    """
+    On-disk cache of bond indices per fragment, stored as one ``.npz``.
+
+    Each source file, element pair and tolerance is kept as a flat (ids,
+    offsets, indices) triple, so loading does not unpickle Python
+    objects and one cache file can be shared between datasets.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tables = {}
+        self._dirty = False
+        if os.path.exists(path):
+            with np.load(path) as data:
+                for name in data.files:
+                    if not name.endswith("/ids"):
+                        continue
+                    key = name[:-len("/ids")]
+                    ids, offsets, indices = data[name], data[key + "/offsets"], data[key + "/indices"]
+                    self._tables[key] = {
+                        i: indices[lo:hi] for i, lo, hi in zip(ids.tolist(), offsets[:-1], offsets[1:])
+                    }
+
+    @staticmethod
+    def key(source, pair, tolerance):
+        return f"{source}:{pair[0]}-{pair[1]}@{tolerance:g}"
+
+    def table(self, source, pair, tolerance):
+        return self._tables.setdefault(self.key(source, pair, tolerance), {})
+
+    def update(self, source, pair, tolerance, found):
+        if found:
+            self.table(source, pair, tolerance).update(found)
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        arrays = {}
+        for key, table in self._tables.items():
+            ids = list(table)
+            values = [table[i] for i in ids]
+            arrays[key + "/ids"] = np.array(ids, dtype=str)
+            arrays[key + "/offsets"] = np.concatenate([[0], np.cumsum([len(v) for v in values])]).astype(np.int64)
+            arrays[key + "/indices"] = (np.concatenate(values) if values else np.zeros(0)).astype(np.int32)
+        with open(self.path, "wb") as f:
+            np.savez(f, **arrays)
+        self._dirty = False
+
+
+def element_pair_bonds(fragments, pair=("C", "Cl"), tolerance=0.45, cache=None, source=None):
+    """
+    Atom indices of ``pair[0]``-``pair[1]`` bonds for every fragment.
+
+    Bonds are perceived from coordinates with a covalent-radius cutoff
+    (``r_a + r_b + tolerance``), no RDKit molecule is built. Fragments with
+    the same atom symbols are stacked and processed in one NumPy pass.
+
+    Parameters:
+    -----------
+    fragments : sequence of Fragment
+        Fragments with ``id``, ``elements`` and ``coords``
+    pair : tuple of str
+        Element symbols of the bond, e.g. ``("C", "I")``
+    tolerance : float
+        Added to the sum of covalent radii, in angstrom
+    cache : str or BondCache, optional
+        Path of an ``.npz`` cache keyed by source file and fragment id;
+        fragments already in it are not perceived again
+    source : str, optional
+        The .cor file ``fragments`` were read from; required with ``cache``
+
+    Returns:
+    --------
+    list of np.ndarray
+        Per fragment, indices [a1, b1, a2, b2, ...] sorted by the first
+        atom, as returned by ``get_c_cl_bond_indices``
+    """
+    if cache is not None:
+        if source is None:
+            raise ValueError("A bond cache needs the source .cor file of the fragments")
+        if isinstance(cache, str):
+            cache = BondCache(cache)
+        source = source_key(source)
+    known = cache.table(source, pair, tolerance) if cache is not None else {}
+
+    result = [None] * len(fragments)
+    groups = {}
+    for i, fragment in enumerate(fragments):
+        cached = known.get(fragment.id)
+        # Indices beyond the atom count mean the cache does not belong to this file
+        if cached is not None and (len(cached) == 0 or cached.max() < len(fragment.elements)):
+            result[i] = np.asarray(cached, dtype=int)
+            continue
+        symbols = tuple(element_symbol(e) for e in fragment.elements)
+        groups.setdefault(symbols, []).append(i)
+
+    found = {}
+    for symbols, members in groups.items():
+        coords = np.stack([np.asarray(fragments[i].coords, dtype=np.float64) for i in members])
+        for i, bonds in zip(members, _pair_bonds(coords, symbols, pair, tolerance)):
+            result[i] = bonds
+            found[fragments[i].id] = bonds
+
+    if cache is not None:
+        cache.update(source, pair, tolerance, found)
+        cache.save()
+    return result
+
+
+def get_bond_indices(fragment, pair=("C", "Cl"), tolerance=0.45):
+    """Drop-in for ``get_c_cl_bond_indices`` and its C-Br/C-I copies for one fragment."""
+    return element_pair_bonds([fragment], pair, tolerance)[0]
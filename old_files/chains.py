@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import copy
+
+import numpy as np
+
+from distances import kabsch_rotations
+
+
+def rigid_transforms(a, b, atom_indices=None, reflection=False):
+    """
+    Rigid transforms superposing each structure of ``a`` onto ``b``.
+
+    Parameters:
+    -----------
+    a, b : np.ndarray
+        (batch, n_atoms, 3) coordinates with matching atom order
+    atom_indices : array-like, optional
+        Atoms used for the fit, as in ``partial_align_fragments``; all
+        atoms if not given
+    reflection : bool
+        Allow improper rotations
+
+    Returns:
+    --------
+    rotations : np.ndarray
+        (batch, 3, 3)
+    translations : np.ndarray
+        (batch, 3); ``a @ rotations + translations[:, None]`` is aligned
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    if atom_indices is not None:
+        a, b = a[:, atom_indices], b[:, atom_indices]
+    ca, cb = a.mean(axis=1), b.mean(axis=1)
+    rotations = kabsch_rotations(a - ca[:, None], b - cb[:, None], reflection)
+    return rotations, cb - np.einsum("bi,bij->bj", ca, rotations)
+
+
+def apply_transforms(coords, rotations, translations):
+    """Apply per-structure rigid transforms to an (n, n_atoms, 3) stack."""
+    return np.einsum("nki,nij->nkj", coords, rotations) + translations[:, None, :]
+
+
+def compose_chain(rotations, translations):
+    """
+    Cumulative transforms along a chain.
+
+    Transform ``k`` maps structure ``k`` onto structure ``k - 1``; the
+    result maps it all the way to the frame of structure 0. Composition
+    is a prefix product of 4x4 affine matrices computed by doubling, so
+    it takes log2(n) batched matmuls instead of an n-step loop.
+    """
+    n = len(rotations)
+    affine = np.zeros((n, 4, 4))
+    affine[:, :3, :3] = rotations
+    affine[:, 3, :3] = translations
+    affine[:, 3, 3] = 1.0
+    step = 1
+    while step < n:
+        # Row-vector convention: x -> x @ M_k @ M_(k-1) @ ... @ M_1
+        affine[step:] = affine[step:] @ affine[:-step]
+        step *= 2
+    return affine[:, :3, :3].copy(), affine[:, 3, :3].copy()
+
+
+class ChainAligner:
+    """
+    Chain alignment along an ordering, kept as transforms instead of copies.
+
+    Replaces ``chain_fragments`` on ``cor[sort_along(...)]``: every
+    fragment is superposed onto its predecessor in the ordering, the
+    pairwise fits are composed into one rigid transform per fragment, and
+    coordinates are only produced when rendering. Pairwise fits are
+    cached by fragment pair, so reordering after a new line pick only
+    fits the pairs that were not neighbours before.
+
+    Parameters:
+    -----------
+    coords : np.ndarray
+        (n_fragments, n_atoms, 3) stacked coordinates of the cluster, e.g.
+        ``stack_coords(clu1)``; orderings index into it
+    atom_indices : array-like, optional
+        Atoms used for the pairwise fits; all atoms if not given
+    reflection : bool
+        Allow improper rotations
+
+    Example:
+    --------
+    >>> chain = ChainAligner(stack_coords(clu1))
+    >>> order = sort_along(w1.line_points, clu1_df, 0.1)
+    >>> rot, shift = chain.transforms(order)
+    >>> rot, shift = chain.realign(order, rot, shift, np.arange(4, 8), 30)
+    >>> Fragment.plot_fragments(chain.fragments(clu1, order, rot, shift))
+    """
+
+    def __init__(self, coords, atom_indices=None, reflection=False):
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.atom_indices = atom_indices
+        self.reflection = reflection
+        self._pairs = {}
+
+    def pair_transforms(self, moving, target):
+        """Cached transforms of fragments ``moving[k]`` onto ``target[k]``."""
+        keys = list(zip(np.asarray(moving).tolist(), np.asarray(target).tolist()))
+        missing = [k for k in dict.fromkeys(keys) if k not in self._pairs]
+        if missing:
+            i, j = np.array(missing).T
+            rotations, translations = rigid_transforms(
+                self.coords[i], self.coords[j], self.atom_indices, self.reflection
+            )
+            self._pairs.update(zip(missing, zip(rotations, translations)))
+        rotations = np.array([self._pairs[k][0] for k in keys]).reshape(-1, 3, 3)
+        translations = np.array([self._pairs[k][1] for k in keys]).reshape(-1, 3)
+        return rotations, translations
+
+    def transforms(self, order):
+        """
+        Per-fragment transforms of the chain along ``order``.
+
+        The first fragment keeps its coordinates. Returned arrays follow
+        ``order``, like ``chain_fragments(cor[order])``.
+        """
+        order = np.asarray(order)
+        rotations = np.empty((len(order), 3, 3))
+        translations = np.empty((len(order), 3))
+        rotations[:1] = np.eye(3)
+        translations[:1] = 0.0
+        if len(order) > 1:
+            rotations[1:], translations[1:] = self.pair_transforms(order[1:], order[:-1])
+        return compose_chain(rotations, translations)
+
+    def aligned(self, order, rotations, translations):
+        """Transformed coordinates of the fragments in ``order``."""
+        return apply_transforms(self.coords[np.asarray(order)], rotations, translations)
+
+    def realign(self, order, rotations, translations, atom_indices, center):
+        """
+        Compose a partial alignment onto ``center``, as
+        ``partial_align_fragments(chain, atom_indices, center)`` would.
+        """
+        current = self.aligned(order, rotations, translations)
+        target = np.broadcast_to(current[center], current.shape)
+        fit_rot, fit_shift = rigid_transforms(current, target, atom_indices, self.reflection)
+        return rotations @ fit_rot, np.einsum("ni,nij->nj", translations, fit_rot) + fit_shift
+
+    def fragments(self, fragments, order, rotations, translations):
+        """
+        Copies of ``fragments[order]`` with transformed coordinates, for
+        ``Fragment.plot_fragments``; the only step that creates fragments.
+        """
+        result = []
+        for fragment, coords in zip(np.asarray(fragments, dtype=object)[np.asarray(order)],
+                                    self.aligned(order, rotations, translations)):
+            fragment = copy.copy(fragment)
+            fragment.coords = coords
+            result.append(fragment)
+        return np.asarray(result, dtype=object)
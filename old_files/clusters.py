@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+# Results keyed by a hash of the embedding and labels, so re-executed
+# notebook cells reuse them instead of recomputing
+_CACHE_SIZE = 32
+_cache = OrderedDict()
+
+
+def _frame_key(*arrays):
+    h = hashlib.blake2b(digest_size=16)
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(str((a.dtype, a.shape)).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def _cached(key, compute, cache=_cache):
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    value = compute()
+    cache[key] = value
+    if len(cache) > _CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+
+def _embedding(df, x_col, y_col):
+    if isinstance(df, np.ndarray):
+        return np.asarray(df, dtype=np.float64)
+    return np.column_stack([df[x_col].to_numpy(), df[y_col].to_numpy()]).astype(np.float64, copy=False)
+
+
+def group_geomedians(points, codes, n_groups=None, tol=1e-7, max_iter=5000):
+    """
+    Geometric median of every group of points, by batched Weiszfeld iterations.
+
+    All groups are updated together with ``np.bincount``; iteration stops
+    once no median moves by more than ``tol``.
+
+    Parameters:
+    -----------
+    points : np.ndarray
+        (n, d) array of points
+    codes : np.ndarray
+        (n,) integer group code per point, in ``range(n_groups)``
+    n_groups : int, optional
+        Number of groups, ``codes.max() + 1`` by default
+
+    Returns:
+    --------
+    np.ndarray
+        (n_groups, d) array of geometric medians
+    """
+    points = np.asarray(points, dtype=np.float64)
+    codes = np.asarray(codes)
+    if n_groups is None:
+        n_groups = int(codes.max()) + 1 if len(codes) else 0
+    dim = points.shape[1]
+
+    def group_sums(weights):
+        return np.stack(
+            [np.bincount(codes, weights=weights * points[:, k], minlength=n_groups) for k in range(dim)],
+            axis=1,
+        )
+
+    counts = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    medians = group_sums(np.ones(len(points))) / np.maximum(counts, 1)[:, None]
+    for _ in range(max_iter):
+        dists = np.linalg.norm(points - medians[codes], axis=1)
+        # Points sitting on the current estimate get a large finite weight
+        weights = 1.0 / np.maximum(dists, 1e-12)
+        total = np.bincount(codes, weights=weights, minlength=n_groups)
+        new = group_sums(weights) / np.maximum(total, 1e-300)[:, None]
+        shift = np.linalg.norm(new - medians, axis=1).max(initial=0.0)
+        medians = new
+        if shift <= tol:
+            break
+    return medians
+
+
+def representative_points(df, label_col="label", x_col="X", y_col="Y"):
+    """
+    Index of the point nearest to the geometric median of every cluster.
+
+    Indices are positions within each cluster's rows, as with
+    ``representative_point_idx(df.filter(pl.col("label") == k))``, so they
+    can be passed straight to ``align_fragments(cor[mask], idx)``. The
+    result is memoized on the embedding and labels.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame
+        UMAP frame with coordinates and cluster labels
+    label_col : str
+        Name of the label column
+
+    Returns:
+    --------
+    dict
+        Mapping from label to the representative point's index in its cluster
+    """
+    points = _embedding(df, x_col, y_col)
+    labels = df[label_col].to_numpy()
+    return _cached(
+        ("representative_points", _frame_key(points, labels)),
+        lambda: _representative_points(points, labels),
+    )
+
+
+def _representative_points(points, labels):
+    values, codes = np.unique(labels, return_inverse=True)
+    n_groups = len(values)
+    medians = group_geomedians(points, codes, n_groups)
+    dists = np.linalg.norm(points - medians[codes], axis=1)
+
+    # Position of every point within its own cluster, in row order
+    by_code = np.argsort(codes, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=n_groups))[:-1]])
+    local = np.empty(len(codes), dtype=np.int64)
+    local[by_code] = np.arange(len(codes)) - starts[codes[by_code]]
+
+    # First point of each cluster after sorting by (cluster, distance)
+    order = np.lexsort((dists, codes))
+    _, first = np.unique(codes[order], return_index=True)
+    nearest = order[first]
+    return {v: int(i) for v, i in zip(values.tolist(), local[nearest])}
+
+
+def representative_point_idx(df, x_col="X", y_col="Y"):
+    """Index of the point nearest to the geometric median of a single cluster."""
+    points = _embedding(df, x_col, y_col)
+    return _cached(
+        ("representative_point_idx", _frame_key(points)),
+        lambda: _representative_points(points, np.zeros(len(points), dtype=np.int64))[0],
+    )
+
+
+class HDBSCANCache:
+    """
+    HDBSCAN with the expensive part computed once per embedding and ``min_samples``.
+
+    Core distances, the mutual-reachability MST and its single-linkage
+    tree depend only on the points and ``min_samples``. They are built
+    once with ``sklearn.cluster.HDBSCAN`` and kept in memory and, with a
+    ``path``, as ``.npy`` files keyed by a hash of the embedding. Labels
+    for any ``min_cluster_size`` / ``cluster_selection_epsilon`` are then
+    extracted from the stored tree, which takes linear time, and match
+    ``HDBSCAN(...).fit(points).labels_``. Both steps use private sklearn
+    internals (``_single_linkage_tree_`` and ``tree_to_labels``); if a
+    sklearn version lacks them, every call falls back to a full fit.
+
+    Parameters:
+    -----------
+    path : str, optional
+        Directory for the trees, e.g. next to the umaps output
+        (``"./no2/no2cl_constr_umaps_hdbscan"``); memory only if not given
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        # Bounded like the module cache; trees on disk are not evicted
+        self._trees = OrderedDict()
+        self._labels = OrderedDict()
+
+    def _tree_path(self, key):
+        return os.path.join(self.path, f"{key}.npy")
+
+    def tree(self, points, min_samples=5):
+        """Single-linkage tree of the mutual-reachability MST, None if sklearn does not expose it."""
+        from sklearn.cluster import HDBSCAN
+
+        points = np.asarray(points, dtype=np.float64)
+        key = f"{_frame_key(points)}-ms{min_samples}"
+
+        def compute():
+            if self.path is not None and os.path.exists(self._tree_path(key)):
+                return np.load(self._tree_path(key))
+            model = HDBSCAN(min_cluster_size=max(2, min_samples), min_samples=min_samples).fit(points)
+            tree = getattr(model, "_single_linkage_tree_", None)
+            if tree is not None and self.path is not None:
+                os.makedirs(self.path, exist_ok=True)
+                np.save(self._tree_path(key), tree)
+            return tree
+
+        return key, _cached(key, compute, self._trees)
+
+    def labels(self, points, min_cluster_size=5, min_samples=None, cluster_selection_epsilon=0.0,
+               cluster_selection_method="eom", allow_single_cluster=False):
+        """
+        Cluster labels as ``HDBSCAN(...).fit(points).labels_``, -1 for noise.
+
+        ``min_samples`` defaults to ``min_cluster_size``, as in sklearn.
+        """
+        from sklearn.cluster import HDBSCAN
+
+        if min_samples is None:
+            min_samples = min_cluster_size
+        tree_to_labels = _tree_to_labels()
+        if tree_to_labels is None:
+            key, tree = f"{_frame_key(np.asarray(points, dtype=np.float64))}-ms{min_samples}", None
+        else:
+            key, tree = self.tree(points, min_samples)
+        params = (key, min_cluster_size, float(cluster_selection_epsilon), cluster_selection_method,
+                  allow_single_cluster)
+
+        def compute():
+            if tree is not None:
+                try:
+                    return tree_to_labels(
+                        tree, min_cluster_size, cluster_selection_method, allow_single_cluster,
+                        float(cluster_selection_epsilon),
+                    )[0]
+                except TypeError:
+                    # Signature of the private function changed
+                    pass
+            return HDBSCAN(
+                min_cluster_size=min_cluster_size, min_samples=min_samples,
+                cluster_selection_epsilon=float(cluster_selection_epsilon),
+                cluster_selection_method=cluster_selection_method, allow_single_cluster=allow_single_cluster,
+            ).fit(points).labels_
+
+        return _cached(params, compute, self._labels)
+
+    def sweep(self, points, min_cluster_size, cluster_selection_epsilon=(0.0,), min_samples=None, **kwargs):
+        """
+        Labels for every combination of ``min_cluster_size`` and epsilon.
+
+        Returns:
+        --------
+        polars.DataFrame
+            One row per combination with ``min_cluster_size``,
+            ``cluster_selection_epsilon``, ``n_clusters`` and ``noise``
+            (fraction of points labelled -1); the labels themselves come
+            from ``labels`` with the same arguments, already cached
+        """
+        import polars as pl
+
+        rows = []
+        for mcs in min_cluster_size:
+            for eps in cluster_selection_epsilon:
+                labels = self.labels(points, mcs, min_samples, eps, **kwargs)
+                rows.append((mcs, float(eps), int(labels.max()) + 1, float(np.mean(labels == -1))))
+        return pl.DataFrame(rows, schema=["min_cluster_size", "cluster_selection_epsilon", "n_clusters", "noise"],
+                            orient="row")
+
+
+def _tree_to_labels():
+    try:
+        from sklearn.cluster._hdbscan._tree import tree_to_labels
+    except ImportError:
+        return None
+    return tree_to_labels
+
+
+_hdbscan_cache = HDBSCANCache()
+
+
+def hdbscan_labels(df, min_cluster_size=15, min_samples=None, cluster_selection_epsilon=0.0, x_col="X", y_col="Y",
+                   cache=None):
+    """
+    Drop-in for ``clu.HDBSCAN(...).fit(df.select(pl.col("X", "Y")).to_numpy()).labels_``.
+
+    Re-executing a cell, or trying another ``min_cluster_size`` or
+    epsilon, reuses the tree built for this embedding and ``min_samples``.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame or np.ndarray
+        UMAP frame for one ``N``, or its (n, 2) coordinates
+    cache : HDBSCANCache or str, optional
+        Cache to use, or a directory to persist trees in; a module-wide
+        in-memory cache by default
+    """
+    if cache is None:
+        cache = _hdbscan_cache
+    elif isinstance(cache, str):
+        cache = HDBSCANCache(cache)
+    return cache.labels(_embedding(df, x_col, y_col), min_cluster_size, min_samples, cluster_selection_epsilon)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+import gzip
+import itertools
+import os
+
+import numpy as np
+
+# CSD .cor layout: "REFCODE **FRAG**        n" headers followed by one
+# fixed-width line per atom (label, x, y, z, serial)
+_HEADER = "%-8s**FRAG**        %s\n"
+_ATOM = "%-8s%12.5f%10.5f%10.5f%12d\n"
+
+
+def _open_write(filename, compression):
+    if compression is None:
+        if filename.endswith(".gz"):
+            compression = "gzip"
+        elif filename.endswith(".zst"):
+            compression = "zstd"
+    if compression is None:
+        return open(filename, "wb")
+    if compression == "gzip":
+        return gzip.open(filename, "wb", compresslevel=6)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd output requires the zstandard package") from None
+        return zstandard.ZstdCompressor().stream_writer(open(filename, "wb"), closefd=True)
+    raise ValueError(f"Unknown compression {compression!r}")
+
+
+def _split_ids(ids):
+    """Vectorized REFCODE_FRAGNUM split; ids without '_' get fragment 1."""
+    ids = np.asarray(ids, dtype=str)
+    head, sep, tail = np.char.rpartition(ids, "_").T
+    has_sep = sep == "_"
+    return np.where(has_sep, head, ids), np.where(has_sep, tail, "1")
+
+
+def _format_chunk(fragments):
+    sizes = np.array([len(f.coords) for f in fragments])
+    refcodes, numbers = _split_ids([f.id for f in fragments])
+    coords = np.concatenate([np.asarray(f.coords, dtype=np.float64).reshape(-1, 3) for f in fragments])
+    labels = list(itertools.chain.from_iterable(f.elements for f in fragments))
+
+    # One flat value tuple and one format string for the whole chunk:
+    # fragment i takes 2 header slots followed by 5 slots per atom
+    block = 2 + 5 * sizes
+    starts = np.concatenate([[0], np.cumsum(block)[:-1]])
+    first_atom = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    local = np.arange(len(coords)) - np.repeat(first_atom, sizes)
+    atom_start = np.repeat(starts, sizes) + 2 + 5 * local
+
+    values = np.empty(block.sum(), dtype=object)
+    values[starts] = refcodes.tolist()
+    values[starts + 1] = numbers.tolist()
+    values[atom_start] = labels
+    values[atom_start + 1] = coords[:, 0].tolist()
+    values[atom_start + 2] = coords[:, 1].tolist()
+    values[atom_start + 3] = coords[:, 2].tolist()
+    values[atom_start + 4] = (local + 1).tolist()
+
+    template = "".join(_HEADER + _ATOM * n for n in sizes.tolist())
+    return template % tuple(values)
+
+
+def write_cor_file(fragments, filename, chunk_size=2048, compression=None):
+    """
+    Write fragments to a .cor file in large formatted blocks.
+
+    Fragments are consumed ``chunk_size`` at a time from any iterable, so
+    a generator never has to be materialized. Each chunk is formatted with
+    a single format operation and written in one call.
+
+    Parameters:
+    -----------
+    fragments : iterable of Fragment
+        Fragments with ``id`` (``REFCODE_FRAGNUM``), ``elements`` and ``coords``
+    filename : str
+        Output filename; ``.gz`` and ``.zst`` suffixes select compression
+    chunk_size : int
+        Number of fragments formatted per block
+    compression : str, optional
+        ``"gzip"`` or ``"zstd"`` (needs ``zstandard``), overriding the suffix
+
+    Returns:
+    --------
+    int
+        Number of fragments written
+    """
+    fragments = iter(fragments)
+    count = 0
+    with _open_write(filename, compression) as f:
+        while True:
+            chunk = list(itertools.islice(fragments, chunk_size))
+            if not chunk:
+                break
+            f.write(_format_chunk(chunk).encode("ascii"))
+            count += len(chunk)
+    return count
+
+
+def _open_read(filename):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt")
+    if filename.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd input requires the zstandard package") from None
+        import io
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), closefd=True))
+    return open(filename)
+
+
+def _store_path(cor_path):
+    for suffix in (".gz", ".zst"):
+        if cor_path.endswith(suffix):
+            cor_path = cor_path[:-len(suffix)]
+    return os.path.splitext(cor_path)[0] + ".corstore"
+
+
+def _parse_cor(cor_path):
+    ids, sizes, labels, xyz = [], [], [], []
+    with _open_read(cor_path) as f:
+        for line in f:
+            if "**FRAG**" in line:
+                refcode, number = line.split("**FRAG**")
+                ids.append(f"{refcode.strip()}_{number.strip()}")
+                sizes.append(0)
+            elif line.strip():
+                fields = line.split()
+                labels.append(fields[0])
+                xyz.append(fields[1:4])
+                sizes[-1] += 1
+    return ids, sizes, labels, xyz
+
+
+def read_cor_coords(cor_path):
+    """
+    Fragment ids and float64 coordinates of a .cor file with same-size fragments.
+
+    Unlike ``CorStore``, which keeps float32, the coordinates are parsed at
+    full precision, e.g. for ``distances.rmsd_matrix``.
+
+    Returns:
+    --------
+    ids : np.ndarray
+        Fragment ids
+    coords : np.ndarray
+        (n_fragments, n_atoms, 3) coordinates
+    """
+    ids, sizes, _, xyz = _parse_cor(cor_path)
+    if len(set(sizes)) > 1:
+        raise ValueError(f"{cor_path}: fragments differ in size")
+    return np.array(ids, dtype=str), np.array(xyz, dtype=np.float64).reshape(len(ids), -1, 3)
+
+
+def convert_cor(cor_path, store_path=None):
+    """
+    Convert a .cor file into a binary store directory for ``CorStore``.
+
+    The store holds flat float32 coordinates, atom labels, element codes,
+    per-fragment offsets and fragment ids as ``.npy`` files.
+
+    Returns:
+    --------
+    str
+        Path of the store, ``<name>.corstore`` next to the .cor by default
+    """
+    from bonds import element_symbol
+
+    store_path = store_path or _store_path(cor_path)
+    ids, sizes, labels, xyz = _parse_cor(cor_path)
+
+    symbols = sorted({element_symbol(label) for label in labels})
+    code_of = {s: i for i, s in enumerate(symbols)}
+    os.makedirs(store_path, exist_ok=True)
+    np.save(os.path.join(store_path, "coords.npy"), np.array(xyz, dtype=np.float32).reshape(-1, 3))
+    np.save(os.path.join(store_path, "labels.npy"), np.array(labels, dtype="S8"))
+    np.save(os.path.join(store_path, "elements.npy"), np.array([code_of[element_symbol(a)] for a in labels], dtype=np.uint8))
+    np.save(os.path.join(store_path, "symbols.npy"), np.array(symbols, dtype=str))
+    np.save(os.path.join(store_path, "offsets.npy"), np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64))
+    np.save(os.path.join(store_path, "ids.npy"), np.array(ids, dtype=str))
+    return store_path
+
+
+class CorStore:
+    """
+    Memory-mapped .cor fragments with random access by position or id.
+
+    Opening maps the arrays without reading them; indexing with an int,
+    slice, boolean mask (e.g. ``df2["label"] == 2``) or index array only
+    touches the selected fragments and returns an object array of
+    ``Fragment``, like ``np.asarray(read_cor_file(...), dtype=object)``.
+    Fragments are built straight from the mapped arrays; elements come
+    from ``bonds.element_symbol`` of the atom labels.
+
+    Parameters:
+    -----------
+    path : str
+        Store directory written by ``convert_cor``
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        def load(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+        self.coords = load("coords")
+        self.labels = load("labels")
+        self.elements = load("elements")
+        self.offsets = load("offsets")
+        self.ids = load("ids")
+        self.symbols = np.load(os.path.join(path, "symbols.npy")).astype("<U2")
+        self._positions = None
+
+    @classmethod
+    def open(cls, cor_path, store_path=None):
+        """Open the store of a .cor file, converting it first if missing or stale."""
+        store_path = store_path or _store_path(cor_path)
+        marker = os.path.join(store_path, "ids.npy")
+        if not os.path.exists(marker) or os.path.getmtime(marker) < os.path.getmtime(cor_path):
+            convert_cor(cor_path, store_path)
+        return cls(store_path)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def positions(self, ids):
+        """Positions of fragments by id."""
+        if self._positions is None:
+            self._positions = {i: n for n, i in enumerate(self.ids.tolist())}
+        return np.array([self._positions[i] for i in ids], dtype=np.int64)
+
+    def _key(self, idx):
+        if hasattr(idx, "to_numpy"):
+            idx = idx.to_numpy()
+        return idx if isinstance(idx, (int, np.integer, slice)) else np.asarray(idx)
+
+    def __getitem__(self, idx):
+        from rmsd_map.mol_io.fragment import Fragment
+
+        key = self._key(idx)
+        fragments = []
+        for i in np.atleast_1d(np.arange(len(self))[key]).tolist():
+            lo, hi = self.offsets[i], self.offsets[i + 1]
+            # Same fields as read_cor_file: element symbols and float32 coordinates
+            fragments.append(Fragment(id=str(self.ids[i]), elements=self.symbols[self.elements[lo:hi]],
+                                      coords=np.array(self.coords[lo:hi])))
+        if isinstance(key, (int, np.integer)):
+            return fragments[0]
+        result = np.empty(len(fragments), dtype=object)
+        result[:] = fragments
+        return result
@@ -0,0 +1,721 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+def _block_names(npz_paths):
+    names, sizes = [], []
+    for path in npz_paths:
+        with np.load(path) as data:
+            names.append(data["names"])
+            sizes.append(len(data["names"]))
+    return names, np.array(sizes)
+
+
+def merge_distance_blocks(npz_paths, out_path, fill=np.inf, dtype=np.float64, chunk_rows=1024, npz=True):
+    """
+    Merge ``rmsd-map-distances`` outputs into one block-diagonal matrix on disk.
+
+    The combined matrix is written to a memory-mapped ``.npy`` one block
+    and one row band at a time, so only a single input block is held in
+    memory. Cross-dataset entries get ``fill``. With ``npz=True`` the
+    result is also packed as ``names``/``distances`` in an ``.npz`` for
+    ``rmsd-map-umaps``; NumPy streams the memmap into it in chunks.
+
+    Parameters:
+    -----------
+    npz_paths : list of str
+        Inputs with ``names`` and square ``distances`` arrays, in order
+    out_path : str
+        Output path without extension; writes ``<out>.npy``,
+        ``<out>_names.npy`` and optionally ``<out>.npz``
+    fill : float
+        Distance between fragments of different datasets
+    dtype : np.dtype
+        Output dtype; float32 halves the disk and page-cache footprint
+    chunk_rows : int
+        Rows written per band when filling off-diagonal entries
+
+    Returns:
+    --------
+    np.memmap
+        The combined (n_total, n_total) matrix, opened read-only
+    """
+    names, sizes = _block_names(npz_paths)
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    n_total = int(bounds[-1])
+
+    matrix = open_memmap(out_path + ".npy", mode="w+", dtype=dtype, shape=(n_total, n_total))
+    for k, path in enumerate(npz_paths):
+        lo, hi = bounds[k], bounds[k + 1]
+        with np.load(path) as data:
+            block = np.asarray(data["distances"], dtype=np.float64)
+        # Same cleanup as the notebook merge: symmetric, zero diagonal
+        block = (block + block.T) / 2
+        np.fill_diagonal(block, 0.0)
+        for r in range(lo, hi, chunk_rows):
+            band = matrix[r:min(r + chunk_rows, hi)]
+            band[:, :lo] = fill
+            band[:, hi:] = fill
+            band[:, lo:hi] = block[r - lo:r - lo + len(band)]
+    matrix.flush()
+    del matrix
+
+    all_names = np.concatenate(names)
+    np.save(out_path + "_names.npy", all_names)
+    matrix = np.load(out_path + ".npy", mmap_mode="r")
+    if npz:
+        np.savez(out_path + ".npz", names=all_names, distances=matrix)
+    return matrix
+
+
+def knn_from_distances(distances, n_neighbors, chunk_rows=1024):
+    """
+    Nearest neighbours of every row of a square distance matrix.
+
+    Rows are processed in bands with ``np.argpartition``, so memory-mapped
+    matrices are never loaded whole. Each point is its own first neighbour,
+    as UMAP expects for ``precomputed_knn``.
+
+    Returns:
+    --------
+    knn_indices : np.ndarray
+        (n, n_neighbors) int64 neighbour indices, nearest first
+    knn_dists : np.ndarray
+        (n, n_neighbors) float32 distances
+    """
+    n = distances.shape[0]
+    k = min(n_neighbors, n)
+    knn_indices = np.empty((n, k), dtype=np.int64)
+    knn_dists = np.empty((n, k), dtype=np.float32)
+    for lo in range(0, n, chunk_rows):
+        band = np.array(distances[lo:lo + chunk_rows], dtype=np.float64)
+        rows = np.arange(len(band))
+        band[rows, rows + lo] = -1.0  # keep self first
+        part = np.argpartition(band, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(band, part, axis=1), axis=1, kind="stable")
+        idx = np.take_along_axis(part, order, axis=1)
+        knn_indices[lo:lo + len(band)] = idx
+        knn_dists[lo:lo + len(band)] = np.maximum(np.take_along_axis(band, idx, axis=1), 0.0)
+    return knn_indices, knn_dists
+
+
+def block_knn(npz_paths, n_neighbors):
+    """
+    kNN graph of a block-diagonal merge without building the merged matrix.
+
+    Fragments of different datasets are never neighbours, so every
+    dataset's neighbours come from its own block, offset into the combined
+    numbering. The result can be passed to UMAP as
+    ``UMAP(metric="precomputed", precomputed_knn=(knn_indices, knn_dists, None))``
+    fitted on ``knn_to_sparse(knn_indices, knn_dists)``.
+
+    Returns:
+    --------
+    names : np.ndarray
+        Concatenated fragment names
+    knn_indices, knn_dists : np.ndarray
+        As returned by ``knn_from_distances``
+    """
+    names, indices, dists = [], [], []
+    offset = 0
+    for path in npz_paths:
+        with np.load(path) as data:
+            block_names = data["names"]
+            block = np.asarray(data["distances"])
+        if len(block_names) < n_neighbors:
+            raise ValueError(f"{os.path.basename(path)} has fewer than {n_neighbors} fragments")
+        idx, d = knn_from_distances(block, n_neighbors)
+        names.append(block_names)
+        indices.append(idx + offset)
+        dists.append(d)
+        offset += len(block_names)
+    return np.concatenate(names), np.concatenate(indices), np.concatenate(dists)
+
+
+def knn_to_sparse(knn_indices, knn_dists):
+    """
+    Symmetric sparse distance matrix holding only the kNN edges.
+
+    Missing entries mean "not a neighbour"; UMAP and HDBSCAN accept it as
+    a sparse ``precomputed`` input. Edges of RMSD 0 are kept as explicit
+    zeros; self edges are dropped.
+    """
+    import scipy.sparse as sp
+
+    n, k = knn_indices.shape
+    rows = np.repeat(np.arange(n), k)
+    cols = knn_indices.ravel().astype(np.int64)
+    dists = knn_dists.ravel()
+    # Union of both directions without sparse arithmetic, which would drop
+    # the explicit zeros of duplicate fragments (RMSD 0) and their edges
+    rows, cols = np.concatenate([rows, cols]), np.concatenate([cols, rows])
+    dists = np.concatenate([dists, dists])
+    off_diagonal = rows != cols
+    rows, cols, dists = rows[off_diagonal], cols[off_diagonal], dists[off_diagonal]
+    order = np.lexsort((cols, rows))
+    rows, cols, dists = rows[order], cols[order], dists[order]
+    first = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])])
+    data = np.maximum.reduceat(dists, first) if len(first) else dists
+    indptr = np.searchsorted(rows[first], np.arange(n + 1))
+    return sp.csr_matrix((data, cols[first], indptr), shape=(n, n))
+
+
+def _upper_mask(lo, hi, n):
+    return np.arange(n)[None, :] > np.arange(lo, hi)[:, None]
+
+
+def save_condensed(out_path, names, distances, dtype=np.float32, chunk_size=1 << 22):
+    """
+    Store a symmetric, zero-diagonal distance matrix as its upper triangle.
+
+    Rows are grouped into compressed chunks of about ``chunk_size``
+    entries, each a separate member of an ``.npz`` so it can be read on
+    its own. float32 quarters, float16 eighths the size of the float64
+    square matrix; the largest rounding error is stored as ``max_error``.
+
+    Parameters:
+    -----------
+    out_path : str
+        Output ``.npz`` path
+    names : np.ndarray
+        Fragment names
+    distances : array-like
+        (n, n) distances; a memmap is read one row band at a time
+    dtype : np.dtype
+        Storage dtype, float32 or float16
+
+    Returns:
+    --------
+    float
+        Maximal absolute error introduced by the storage dtype
+    """
+    n = distances.shape[0]
+    arrays = {"names": np.asarray(names), "n": np.array(n)}
+    bounds = [0]
+    max_error = 0.0
+    while bounds[-1] < n - 1:
+        lo = bounds[-1]
+        # Row i holds n - i - 1 entries; grow the band up to chunk_size
+        hi = lo + 1
+        total = n - lo - 1
+        while hi < n - 1 and total + (n - hi - 1) <= chunk_size:
+            total += n - hi - 1
+            hi += 1
+        band = np.asarray(distances[lo:hi], dtype=np.float64)
+        values = band[_upper_mask(lo, hi, n)]
+        stored = values.astype(dtype)
+        max_error = max(max_error, float(np.abs(stored.astype(np.float64) - values).max(initial=0.0)))
+        arrays[f"tri/{len(bounds) - 1}"] = stored
+        bounds.append(hi)
+    arrays["bounds"] = np.array(bounds, dtype=np.int64)
+    arrays["max_error"] = np.array(max_error)
+    np.savez_compressed(out_path, **arrays)
+    return max_error
+
+
+class CondensedDistances:
+    """
+    Lazily expanded distances saved by ``save_condensed``.
+
+    Nothing but the names is read on open. ``condensed()`` returns the
+    scipy ``squareform`` vector and ``square()`` (or ``np.asarray``)
+    builds the full matrix only when a consumer needs it.
+    """
+
+    def __init__(self, path):
+        self._data = np.load(path)
+        self.names = self._data["names"]
+        self.n = int(self._data["n"])
+        self.bounds = self._data["bounds"]
+        self.max_error = float(self._data["max_error"])
+        self.shape = (self.n, self.n)
+
+    def chunks(self):
+        """Yield ``(lo, hi, values)`` for each stored band of rows."""
+        for k in range(len(self.bounds) - 1):
+            yield self.bounds[k], self.bounds[k + 1], self._data[f"tri/{k}"]
+
+    def condensed(self, dtype=None):
+        values = [v for _, _, v in self.chunks()]
+        out = np.concatenate(values) if values else np.zeros(0)
+        return out if dtype is None else out.astype(dtype)
+
+    def square(self, dtype=np.float64, out=None):
+        """Full matrix; ``out`` may be a preallocated array or memmap."""
+        if out is None:
+            out = np.zeros(self.shape, dtype=dtype)
+        for lo, hi, values in self.chunks():
+            mask = _upper_mask(lo, hi, self.n)
+            out[lo:hi][mask] = values
+            out[:, lo:hi].T[mask] = values
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        return self.square(dtype or np.float64)
+
+
+def load_distances(path, square=True):
+    """
+    Names and distances from either a plain ``rmsd-map-distances`` ``.npz``
+    or a condensed one; ``square=False`` keeps condensed data lazy.
+    """
+    with np.load(path) as data:
+        condensed = "bounds" in data.files
+    if not condensed:
+        with np.load(path) as data:
+            return data["names"], data["distances"]
+    distances = CondensedDistances(path)
+    return distances.names, distances.square() if square else distances
+
+
+def _centered(coords):
+    coords = np.asarray(coords, dtype=np.float64)
+    return coords - coords.mean(axis=-2, keepdims=True)
+
+
+def kabsch_rmsd(a, b, reflection=True):
+    """
+    RMSD after optimal superposition for batches of centred structures.
+
+    Parameters:
+    -----------
+    a, b : np.ndarray
+        (batch, n_atoms, 3) centred coordinates with matching atom order
+    reflection : bool
+        Also allow improper rotations (mirror images), as the default
+        ``rmsd-map-distances`` kind does; ``False`` for proper rotations only
+
+    Returns:
+    --------
+    np.ndarray
+        (batch,) RMSD values
+    """
+    h = np.einsum("bki,bkj->bij", a, b)
+    e0 = np.einsum("bki,bki->b", a, a) + np.einsum("bki,bki->b", b, b)
+    return _rmsd_from_covariance(h, e0, a.shape[1], reflection)
+
+
+def _rmsd_from_covariance(h, e0, n_atoms, reflection):
+    """Kabsch RMSD from (..., 3, 3) covariances and summed squared norms."""
+    s = np.linalg.svd(h, compute_uv=False)
+    if not reflection:
+        # Flip the smallest singular value when the best fit is a reflection
+        s[..., -1] *= np.sign(np.linalg.det(h))
+    return np.sqrt(np.maximum(e0 - 2 * s.sum(axis=-1), 0.0) / n_atoms)
+
+
+def kabsch_rotations(a, b, reflection=True):
+    """
+    Optimal rotations for batches of centred structures.
+
+    Returns (batch, 3, 3) matrices ``r`` such that ``a @ r`` is the best
+    superposition of ``a`` onto ``b``.
+    """
+    h = np.einsum("bki,bkj->bij", a, b)
+    u, _, vt = np.linalg.svd(h)
+    if not reflection:
+        d = np.sign(np.linalg.det(u @ vt))
+        u = u.copy()
+        u[:, :, -1] *= d[:, None]
+    return u @ vt
+
+
+def pair_rmsd(coords, i, j, permutations=None, reflection=True, chunk_size=1 << 16):
+    """
+    RMSD of fragment pairs ``(i[k], j[k])``, minimized over atom permutations.
+
+    ``coords`` is the centred (n_fragments, n_atoms, 3) stack. For
+    symmetric fragments pass their atom automorphisms, e.g. the identity
+    and the reversed order for the hexane chains.
+    """
+    if permutations is None:
+        permutations = [np.arange(coords.shape[1])]
+    i, j = np.asarray(i), np.asarray(j)
+    out = np.full(len(i), np.inf)
+    for lo in range(0, len(i), chunk_size):
+        a = coords[i[lo:lo + chunk_size]]
+        b = coords[j[lo:lo + chunk_size]]
+        for perm in permutations:
+            out[lo:lo + chunk_size] = np.minimum(out[lo:lo + chunk_size], kabsch_rmsd(a, b[:, perm], reflection))
+    return out
+
+
+def distance_fingerprints(coords, n_components=16):
+    """
+    Sorted interatomic distances per fragment, optionally PCA-reduced.
+
+    They are invariant to rotation, reflection and atom permutation, and
+    fragments close in RMSD have close fingerprints, which makes them a
+    cheap pre-filter for neighbour candidates.
+    """
+    n_atoms = coords.shape[1]
+    iu = np.triu_indices(n_atoms, 1)
+    diff = coords[:, iu[0], :] - coords[:, iu[1], :]
+    fp = np.sort(np.linalg.norm(diff, axis=-1), axis=1)
+    if n_components is not None and fp.shape[1] > n_components:
+        centred = fp - fp.mean(axis=0)
+        _, _, vt = np.linalg.svd(centred[:min(len(fp), 20000)], full_matrices=False)
+        fp = centred @ vt[:n_components].T
+    return fp
+
+
+def _best_neighbors(candidates, rmsd, n_neighbors):
+    """Keep the nearest distinct candidates of each row, the row itself first."""
+    n = len(candidates)
+    rmsd = np.where(candidates == np.arange(n)[:, None], -1.0, rmsd)
+    sort_c = np.argsort(candidates, axis=1, kind="stable")
+    c = np.take_along_axis(candidates, sort_c, axis=1)
+    r = np.take_along_axis(rmsd, sort_c, axis=1)
+    r[:, 1:][c[:, 1:] == c[:, :-1]] = np.inf
+    order = np.argsort(r, axis=1, kind="stable")[:, :n_neighbors]
+    return np.take_along_axis(c, order, axis=1), np.take_along_axis(r, order, axis=1)
+
+
+def _hop_candidates(knn_indices, evaluated, budget):
+    """
+    New neighbour-of-neighbour pairs per row, closest hops first.
+
+    Hops already in ``evaluated`` (sorted ``row * n + col`` keys) or
+    repeated within a row are dropped; at most ``budget`` remain per row,
+    ranked by the sum of both neighbour ranks.
+    """
+    n, k = knn_indices.shape
+    rank = np.arange(1, k)[:, None] + np.arange(k)[None, :]
+    rows = np.repeat(np.arange(n), (k - 1) * k)
+    cols = knn_indices[knn_indices[:, 1:]].ravel()
+    rank = np.broadcast_to(rank, (n, k - 1, k)).ravel()
+    keys = rows * n + cols
+    new = (rows != cols) & ~np.isin(keys, evaluated)
+    keys, rank = keys[new], rank[new]
+    # First occurrence of each pair in rank order, then rows in rank order
+    order = np.lexsort((rank, keys))
+    keys, rank = keys[order], rank[order]
+    first = np.r_[True, keys[1:] != keys[:-1]]
+    keys, rank = keys[first], rank[first]
+    rows = keys // n
+    order = np.lexsort((rank, rows))
+    keys, rows = keys[order], rows[order]
+    start = np.searchsorted(rows, np.arange(n))
+    position = np.arange(len(rows)) - start[rows]
+    keep = position < budget
+    return rows[keep], keys[keep] % n, position[keep]
+
+
+def rmsd_knn_graph(coords, n_neighbors, oversample=4, refine=1, permutations=None, reflection=True):
+    """
+    Approximate RMSD kNN graph without the all-pairs matrix.
+
+    Candidates are the ``oversample * n_neighbors`` nearest fragments by
+    distance fingerprint (KD-tree, O(N log N)); exact RMSD is computed only
+    for those pairs and the best ``n_neighbors`` are kept. Each ``refine``
+    round then also tries the neighbours of neighbours, as in NN-descent:
+    pairs already evaluated and repeats are skipped and at most
+    ``oversample * n_neighbors`` new hops per fragment get an exact RMSD,
+    the closest-ranked first, so a round costs no more than the initial
+    candidate pass.
+    Feed the result to UMAP as ``precomputed_knn`` (see ``block_knn``).
+
+    Parameters:
+    -----------
+    coords : np.ndarray
+        (n_fragments, n_atoms, 3) stacked coordinates, e.g. from
+        ``descriptors.stack_coords``
+    n_neighbors : int
+        Neighbours per fragment, including the fragment itself
+    oversample : int
+        Fingerprint candidates examined per requested neighbour
+    refine : int
+        Rounds of neighbour-of-neighbour refinement
+    permutations, reflection
+        As in ``pair_rmsd``
+
+    Returns:
+    --------
+    knn_indices : np.ndarray
+        (n, n_neighbors) int64 neighbour indices, nearest first
+    knn_dists : np.ndarray
+        (n, n_neighbors) float32 RMSD values
+    """
+    from scipy.spatial import cKDTree
+
+    coords = _centered(coords)
+    n = len(coords)
+    n_neighbors = min(n, n_neighbors)
+    n_candidates = min(n, max(n_neighbors, oversample * n_neighbors))
+    fp = distance_fingerprints(coords)
+    _, candidates = cKDTree(fp).query(fp, k=n_candidates, workers=-1)
+    candidates = candidates.reshape(n, n_candidates)
+
+    def exact(candidates):
+        rows = np.repeat(np.arange(n), candidates.shape[1])
+        rmsd = pair_rmsd(coords, rows, candidates.ravel(), permutations, reflection)
+        return rmsd.reshape(candidates.shape)
+
+    knn_indices, knn_dists = _best_neighbors(candidates, exact(candidates), n_neighbors)
+    evaluated = np.unique(np.repeat(np.arange(n), n_candidates) * n + candidates.ravel())
+    for _ in range(refine):
+        rows, cols, position = _hop_candidates(knn_indices, evaluated, n_candidates)
+        if len(rows) == 0:
+            break
+        evaluated = np.union1d(evaluated, rows * n + cols)
+        # Rows with fewer hops are padded with the row itself, which _best_neighbors ignores
+        width = position.max() + 1
+        hops = np.repeat(np.arange(n)[:, None], width, axis=1)
+        rmsd = np.zeros((n, width))
+        hops[rows, position] = cols
+        rmsd[rows, position] = pair_rmsd(coords, rows, cols, permutations, reflection)
+        knn_indices, knn_dists = _best_neighbors(
+            np.concatenate([knn_indices, hops], axis=1),
+            np.concatenate([knn_dists, rmsd], axis=1),
+            n_neighbors,
+        )
+    return knn_indices.astype(np.int64), np.maximum(knn_dists, 0.0).astype(np.float32)
+
+
+def rmsd_query_knn(coords, ref_coords, n_neighbors, oversample=8, permutations=None, reflection=True):
+    """
+    Nearest reference fragments of new fragments by RMSD.
+
+    Same fingerprint pre-filter as ``rmsd_knn_graph``, but only the
+    ``n_new x oversample * n_neighbors`` new-to-reference pairs get an
+    exact RMSD; reference pairs are never recomputed.
+
+    Returns:
+    --------
+    knn_indices : np.ndarray
+        (n_new, n_neighbors) int64 indices into ``ref_coords``, nearest first
+    knn_dists : np.ndarray
+        (n_new, n_neighbors) float32 RMSD values
+    """
+    from scipy.spatial import cKDTree
+
+    n_ref = len(ref_coords)
+    stacked = np.concatenate([_centered(ref_coords), _centered(coords)])
+    n_neighbors = min(n_ref, n_neighbors)
+    n_candidates = min(n_ref, max(n_neighbors, oversample * n_neighbors))
+    # One fingerprint basis for both sets
+    fp = distance_fingerprints(stacked)
+    _, candidates = cKDTree(fp[:n_ref]).query(fp[n_ref:], k=n_candidates, workers=-1)
+    candidates = candidates.reshape(-1, n_candidates)
+
+    rows = np.repeat(np.arange(len(candidates)) + n_ref, n_candidates)
+    rmsd = pair_rmsd(stacked, rows, candidates.ravel(), permutations, reflection).reshape(candidates.shape)
+    order = np.argsort(rmsd, axis=1, kind="stable")[:, :n_neighbors]
+    knn_indices = np.take_along_axis(candidates, order, axis=1)
+    return knn_indices.astype(np.int64), np.take_along_axis(rmsd, order, axis=1).astype(np.float32)
+
+
+def farthest_point_landmarks(coords, n_landmarks, permutations=None, reflection=True, seed=None, out=None):
+    """
+    Landmarks chosen by farthest-point sampling in RMSD.
+
+    Each new landmark is the fragment farthest from all previous ones.
+    Its RMSD to every fragment is needed for that choice anyway, so the
+    (n, n_landmarks) block comes out as a by-product: n * n_landmarks
+    RMSD evaluations in total, never the n x n matrix.
+
+    Parameters:
+    -----------
+    coords : np.ndarray
+        (n_fragments, n_atoms, 3) stacked coordinates
+    n_landmarks : int
+        Number of landmarks M
+    permutations, reflection
+        As in ``pair_rmsd``
+    seed : int, optional
+        Seed for the random first landmark
+    out : np.ndarray, optional
+        (n, n_landmarks) array to fill, e.g. an ``open_memmap`` for
+        blocks that do not fit in memory
+
+    Returns:
+    --------
+    landmarks : np.ndarray
+        int64 fragment indices of the landmarks, in selection order
+    block : np.ndarray
+        (n, n_landmarks) float32 RMSD to each landmark
+    """
+    coords = _centered(coords)
+    n = len(coords)
+    n_landmarks = min(n, n_landmarks)
+    block = np.empty((n, n_landmarks), dtype=np.float32) if out is None else out
+    landmarks = np.empty(n_landmarks, dtype=np.int64)
+    landmarks[0] = np.random.default_rng(seed).integers(n)
+    nearest = np.full(n, np.inf)
+    rows = np.arange(n)
+    for m in range(n_landmarks):
+        if m > 0:
+            landmarks[m] = np.argmax(nearest)
+        rmsd = pair_rmsd(coords, rows, np.full(n, landmarks[m]), permutations, reflection)
+        block[:, m] = rmsd
+        nearest = np.minimum(nearest, rmsd)
+    return landmarks, block
+
+
+def _tile_rmsd(coords, sq_norms, rows, cols, permutations, reflection):
+    """(len(rows), len(cols)) RMSD block, one batched SVD per permutation."""
+    a, b = coords[rows], coords[cols]
+    e0 = sq_norms[rows][:, None] + sq_norms[cols][None, :]
+    out = np.full((len(rows), len(cols)), np.inf)
+    for perm in permutations:
+        h = np.einsum("xka,ykb->xyab", a, b[:, perm])
+        out = np.minimum(out, _rmsd_from_covariance(h, e0, coords.shape[1], reflection))
+    return out
+
+
+# Per-process view of the shared coordinate stack, set by _attach
+_shared = {}
+
+
+def _attach(name, shape, permutations, reflection):
+    shm = shared_memory.SharedMemory(name=name)
+    coords = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _shared.update(
+        shm=shm,
+        coords=coords,
+        sq_norms=np.einsum("nki,nki->n", coords, coords),
+        permutations=permutations,
+        reflection=reflection,
+    )
+
+
+def _shared_tile(lo_i, hi_i, lo_j, hi_j):
+    # Runs in a worker process
+    block = _tile_rmsd(
+        _shared["coords"], _shared["sq_norms"], np.arange(lo_i, hi_i), np.arange(lo_j, hi_j),
+        _shared["permutations"], _shared["reflection"],
+    )
+    return lo_i, lo_j, block
+
+
+def rmsd_matrix(coords, permutations=None, reflection=True, tile=256, processes=None, out=None,
+                dtype=np.float64):
+    """
+    All-pairs RMSD of same-size fragments with tiled, batched Kabsch.
+
+    Coordinates are centred into one contiguous (n, n_atoms, 3) stack.
+    The upper triangle is cut into ``tile x tile`` blocks. Each block gets
+    its (tile, tile, 3, 3) covariances from one ``einsum`` and one batched
+    SVD per atom permutation. Blocks are spread over a process pool whose
+    workers read the stack from shared memory, so it is never pickled.
+
+    Parameters:
+    -----------
+    coords : np.ndarray
+        (n_fragments, n_atoms, 3) stacked coordinates, e.g. from
+        ``descriptors.stack_coords`` or ``CorStore.coords``
+    permutations, reflection
+        As in ``pair_rmsd``
+    tile : int
+        Fragments per block side; memory per block is about
+        ``tile**2 * 150`` bytes
+    processes : int, optional
+        Number of worker processes; 1 runs everything in this process
+    out : np.ndarray, optional
+        (n, n) array to fill, e.g. an ``open_memmap``
+    dtype : np.dtype
+        dtype of the result when ``out`` is not given
+
+    Returns:
+    --------
+    np.ndarray
+        (n, n) symmetric RMSD matrix with a zero diagonal
+    """
+    coords = _centered(coords)
+    n = len(coords)
+    if permutations is None:
+        permutations = [np.arange(coords.shape[1])]
+    if out is None:
+        out = np.empty((n, n), dtype=dtype)
+    bounds = list(range(0, n, tile)) + [n]
+    tiles = [(bounds[a], bounds[a + 1], bounds[b], bounds[b + 1])
+             for a in range(len(bounds) - 1) for b in range(a, len(bounds) - 1)]
+
+    def store(lo_i, lo_j, block):
+        out[lo_i:lo_i + block.shape[0], lo_j:lo_j + block.shape[1]] = block
+        out[lo_j:lo_j + block.shape[1], lo_i:lo_i + block.shape[0]] = block.T
+
+    if processes == 1:
+        sq_norms = np.einsum("nki,nki->n", coords, coords)
+        for lo_i, hi_i, lo_j, hi_j in tiles:
+            store(lo_i, lo_j, _tile_rmsd(coords, sq_norms, np.arange(lo_i, hi_i), np.arange(lo_j, hi_j),
+                                         permutations, reflection))
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=coords.nbytes)
+        try:
+            np.ndarray(coords.shape, dtype=np.float64, buffer=shm.buf)[:] = coords
+            # spawn, not fork: forking after numba started its threading layer
+            # (e.g. a UMAP fit in the notebook) leaves the workers or the parent hanging
+            with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_attach,
+                                     initargs=(shm.name, coords.shape, permutations, reflection)) as pool:
+                futures = [pool.submit(_shared_tile, *t) for t in tiles]
+                for future in as_completed(futures):
+                    store(*future.result())
+        finally:
+            shm.close()
+            shm.unlink()
+    np.fill_diagonal(out, 0.0)
+    return out
+
+
+if __name__ == "__main__":
+    # Benchmark: pair-by-pair Kabsch vs tiled batched kernel, one process and a pool
+    import glob
+    import sys
+    import time
+
+    from cor_io import read_cor_coords
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    datasets = {
+        "conformer": (os.path.join(root, "conformer", "hexanes_rwp5_constr.cor"), [np.arange(6), np.arange(6)[::-1]]),
+    }
+    for path in sorted(glob.glob(os.path.join(root, "phcl", "*.cor"))):
+        datasets["phcl"] = (path, None)
+    if "phcl" not in datasets:
+        print("phcl: no .cor file next to PhClClPh.tab, skipped", file=sys.stderr)
+
+    for name, (path, perms) in datasets.items():
+        # float64 coordinates as parsed from the .cor, so only the kernels differ
+        try:
+            _, coords = read_cor_coords(path)
+        except ValueError as e:
+            print(f"{name}: {e}, skipped", file=sys.stderr)
+            continue
+        n, n_atoms = coords.shape[:2]
+        centred = _centered(coords)
+        perm_list = perms if perms is not None else [np.arange(n_atoms)]
+
+        # Fragment-by-fragment reference on a subset, extrapolated to n^2 / 2
+        m = min(n, 150)
+        t0 = time.perf_counter()
+        loop = np.zeros((m, m))
+        for i in range(m):
+            for j in range(i + 1, m):
+                loop[i, j] = loop[j, i] = min(
+                    kabsch_rmsd(centred[i:i + 1], centred[j:j + 1][:, p], True)[0] for p in perm_list
+                )
+        t_loop = (time.perf_counter() - t0) * (n * (n - 1)) / (m * (m - 1))
+
+        t0 = time.perf_counter()
+        serial = rmsd_matrix(coords, perms, processes=1)
+        t1 = time.perf_counter()
+        pooled = rmsd_matrix(coords, perms)
+        t2 = time.perf_counter()
+        line = (f"{name}: n={n}, pair loop ~{t_loop:.1f} s (extrapolated), batched {t1 - t0:.2f} s, "
+                f"pool of {os.cpu_count()} {t2 - t1:.2f} s, "
+                f"max |loop - batched| {np.abs(loop - serial[:m, :m]).max():.1e}, "
+                f"pool identical: {np.array_equal(serial, pooled)}")
+        reference = os.path.splitext(path)[0] + ".npz"
+        if os.path.exists(reference):
+            with np.load(reference) as data:
+                line += f", max |rmsd-map-distances - batched| {np.abs(data['distances'] - serial).max():.1e}"
+        print(line)
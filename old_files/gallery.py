@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+ClusterView = namedtuple("ClusterView", ["label", "n_total", "n_sampled", "html", "timings"])
+ClusterView.__doc__ = """
+Rendered cluster: its label, cluster size, number of sampled fragments,
+the 3D view as a full HTML page and per-stage timings in seconds.
+"""
+
+
+def _align_and_render(fragments, center, atom_indices):
+    # Runs in a worker process
+    from rmsd_map.mol_io.fragment import Fragment
+    from rmsd_map.rmsd.pipelines import align_fragments, partial_align_fragments
+
+    timings = {}
+    t0 = time.perf_counter()
+    if atom_indices is None:
+        aligned = align_fragments(fragments, center)
+    else:
+        aligned = partial_align_fragments(fragments, atom_indices, n_center=center)
+    t1 = time.perf_counter()
+    html = Fragment.plot_fragments(aligned).write_html(fullpage=True)
+    t2 = time.perf_counter()
+    timings["align"] = t1 - t0
+    timings["render"] = t2 - t1
+    return html, timings
+
+
+def cluster_gallery(cor, labels, n_samples=500, center=0, atom_indices=None, processes=None, seed=None):
+    """
+    Align and render a sample of every cluster in parallel.
+
+    Sampling and reference atom indices are computed here; alignment and
+    HTML generation of each cluster run in a process pool. Clusters are
+    yielded as they finish, not in label order.
+
+    Parameters:
+    -----------
+    cor : np.ndarray
+        Object array of fragments, in the same order as ``labels``
+    labels : array-like
+        Cluster label per fragment, e.g. ``df2["label"]``
+    n_samples : int
+        Maximal number of fragments sampled per cluster
+    center : int
+        Index of the reference fragment within the sample
+    atom_indices : callable or np.ndarray, optional
+        Atom indices for partial alignment, or a function computing them
+        from the reference fragment (e.g. ``get_c_cl_bond_indices``);
+        all atoms are aligned if not given
+    processes : int, optional
+        Number of worker processes; 1 runs everything in this process
+    seed : int, optional
+        Seed for the per-cluster sampling
+
+    Yields:
+    -------
+    ClusterView
+    """
+    labels = np.asarray(labels)
+    rng = np.random.default_rng(seed)
+
+    tasks = []
+    for label in np.unique(labels):
+        t0 = time.perf_counter()
+        members = cor[labels == label]
+        n = min(n_samples, len(members))
+        fragments = members[rng.choice(len(members), size=n, replace=False)]
+        t1 = time.perf_counter()
+        indices = atom_indices(fragments[center]) if callable(atom_indices) else atom_indices
+        t2 = time.perf_counter()
+        tasks.append((label, len(members), fragments, indices, {"sample": t1 - t0, "indices": t2 - t1}))
+
+    if processes == 1:
+        for label, n_total, fragments, indices, timings in tasks:
+            html, worker_timings = _align_and_render(fragments, center, indices)
+            yield ClusterView(label, n_total, len(fragments), html, {**timings, **worker_timings})
+        return
+
+    # spawn, not fork: forking after numba started its threading layer (any
+    # UMAP fit in the notebook) leaves the workers or the parent hanging
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(_align_and_render, fragments, center, indices): (label, n_total, len(fragments), timings)
+            for label, n_total, fragments, indices, timings in tasks
+        }
+        for future in as_completed(futures):
+            label, n_total, n_sampled, timings = futures[future]
+            html, worker_timings = future.result()
+            yield ClusterView(label, n_total, n_sampled, html, {**timings, **worker_timings})
+
+
+def show_cluster_gallery(cor, labels, **kwargs):
+    """
+    Display ``cluster_gallery`` views in a notebook as they complete.
+
+    Takes the same arguments as ``cluster_gallery`` and returns the
+    summed per-stage timings.
+    """
+    from IPython.display import HTML, display
+
+    totals = {}
+    t0 = time.perf_counter()
+    for view in cluster_gallery(cor, labels, **kwargs):
+        stages = ", ".join(f"{k} {v:.2f} s" for k, v in view.timings.items())
+        print(f"Cluster {view.label} has {view.n_sampled} fragments (sampled from {view.n_total}): {stages}")
+        display(HTML(view.html))
+        for k, v in view.timings.items():
+            totals[k] = totals.get(k, 0.0) + v
+    totals["wall"] = time.perf_counter() - t0
+    print("Total: " + ", ".join(f"{k} {v:.2f} s" for k, v in totals.items()))
+    return totals
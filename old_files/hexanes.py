@@ -10,13 +10,25 @@ def _():
     import polars as pl
     import numpy as np
     import seaborn as sns
-    import hdmedians as hdm
 
     import rmsd_map
     from rmsd_map.mol_io.cor_reader import read_cor_file
     from rmsd_map.mol_io.fragment import Fragment
     from rmsd_map.rmsd.pipelines import align_fragments
-    return Fragment, align_fragments, hdm, mo, np, pl, read_cor_file, sns
+
+    from clusters import representative_points
+    from umaps import scan_umaps
+    return (
+        Fragment,
+        align_fragments,
+        mo,
+        np,
+        pl,
+        read_cor_file,
+        representative_points,
+        scan_umaps,
+        sns,
+    )
 
 
 @app.cell
@@ -36,33 +48,21 @@ def _(mo):
 
 
 @app.cell
-def _(np, pl, read_cor_file):
+def _(np, read_cor_file, scan_umaps):
     # Reading files
 
     cor = read_cor_file("./hexanes_rwp5_constr.cor")
     cor = np.asarray(cor, dtype=object)
-    um = pl.read_csv("./hexanes_rwp5_constr_umaps.csv") # Vanilla UMAP
-    ud = pl.read_csv("./hexanes_rwp5_constr_umaps_d.csv") # Denity-preserving UMAP 
+    um = scan_umaps("./hexanes_rwp5_constr_umaps") # Vanilla UMAP
+    ud = scan_umaps("./hexanes_rwp5_constr_umaps_d") # Denity-preserving UMAP 
     return cor, ud
 
 
-@app.cell
-def _(hdm, np, pl):
-    # stupid central point chooser
-
-    def representative_point_idx(df):
-        points = df.select(pl.col("X", "Y")).to_numpy()
-        median = hdm.geomedian(points, axis = 0)
-        dists = np.linalg.norm(points - median, axis=1)
-        return np.argmin(dists)
-    return (representative_point_idx,)
-
-
 @app.cell
 def _(pl, sns, ud):
     # Chose umap/distmap and N neighbors
 
-    df = ud.filter(pl.col("N") == 30)
+    df = ud.filter(pl.col("N") == 30).collect()
     sns.scatterplot(data = df , x="X", y="Y")
     return (df,)
 
@@ -90,10 +90,10 @@ def _(Fragment, cor, df2, mo):
 
 
 @app.cell
-def _(Fragment, align_fragments, clu0, df2, mo, pl, representative_point_idx):
+def _(Fragment, align_fragments, clu0, df2, mo, representative_points):
     # Now aligned version
 
-    clu0_center_idx = representative_point_idx(df2.filter(pl.col("label") == 0) ) # find a central point on umap
+    clu0_center_idx = representative_points(df2)[0] # find a central point on umap
     clu0_aligned = align_fragments(clu0, clu0_center_idx) # and align all fragments to it
 
     clu0_view = Fragment.plot_fragments(clu0_aligned)
@@ -102,11 +102,11 @@ def _(Fragment, align_fragments, clu0, df2, mo, pl, representative_point_idx):
 
 
 @app.cell
-def _(Fragment, align_fragments, cor, df2, mo, pl, representative_point_idx):
+def _(Fragment, align_fragments, cor, df2, mo, representative_points):
     # CLuster 1
 
     clu1 = cor[df2["label"] == 1]
-    clu1_center_idx = representative_point_idx(df2.filter(pl.col("label") == 1) )
+    clu1_center_idx = representative_points(df2)[1]
     clu1_aligned = align_fragments(clu1, clu1_center_idx)
 
     clu1_view = Fragment.plot_fragments(clu1_aligned)
@@ -122,13 +122,12 @@ def _(
     dbscan,
     df2,
     mo,
-    pl,
-    representative_point_idx,
+    representative_points,
 ):
     # Cluster 2
 
     clu2 = cor[dbscan.labels_ == 2]
-    clu2_center_idx = representative_point_idx(df2.filter(pl.col("label") == 2) )
+    clu2_center_idx = representative_points(df2)[2]
     clu2_aligned = align_fragments(clu2, clu2_center_idx)
     clu2_view = Fragment.plot_fragments(clu2_aligned)
     mo.iframe(clu2_view.write_html(fullpage=True),height=400)
@@ -143,13 +142,12 @@ def _(
     dbscan,
     df2,
     mo,
-    pl,
-    representative_point_idx,
+    representative_points,
 ):
     # Cluster 3
 
     clu3 = cor[dbscan.labels_ == 3]
-    clu3_center_idx = representative_point_idx(df2.filter(pl.col("label") == 3) )
+    clu3_center_idx = representative_points(df2)[3]
 
     clu3_aligned = align_fragments(clu3, clu3_center_idx)
 
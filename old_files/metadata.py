@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import polars as pl
+
+
+def _tab_column(name):
+    return name if name.startswith("[") else f"[{name}]"
+
+
+def scan_tab(path, columns=None, strict=True):
+    """
+    Lazy frame of a CSD ``.tab`` export (ConQuest tab-separated table).
+
+    Header names lose their square brackets (``[REFCODE]`` -> ``REFCODE``)
+    and all values are read as strings; nothing is parsed until
+    ``collect()``, and only the selected columns are.
+
+    Parameters:
+    -----------
+    path : str
+        The ``.tab`` file, e.g. ``conformer/hexanes_rwp5.tab``
+    columns : list of str, optional
+        Columns to keep besides ``REFCODE``, with or without brackets,
+        e.g. ``["_refine_ls_R_factor", "_cell_measurement_temperature"]``
+    strict : bool
+        Raise ``KeyError`` for requested columns missing from the file;
+        otherwise they are skipped
+    """
+    lazy = pl.scan_csv(path, separator="\t", quote_char=None, infer_schema=False)
+    names = [c for c in lazy.collect_schema().names() if c]  # rows end with a tab
+    if columns is not None:
+        wanted = {_tab_column(c) for c in columns} | {"[REFCODE]"}
+        missing = wanted.difference(names)
+        if missing and strict:
+            raise KeyError(f"{path} has no columns {sorted(missing)}")
+        names = [c for c in names if c in wanted]
+    return lazy.select(pl.col(c).alias(c.strip("[]")) for c in names)
+
+
+def refcode(name_col="name"):
+    """Expression for the REFCODE of ``REFCODE_FRAGNUM`` fragment ids."""
+    return pl.col(name_col).str.replace(r"_[^_]*$", "")
+
+
+def _numeric(frame, columns):
+    # Cast columns whose non-empty values all parse as numbers
+    casts = []
+    for c in columns:
+        values = frame[c].replace("", None)
+        parsed = values.cast(pl.Float64, strict=False)
+        if parsed.null_count() == values.null_count():
+            casts.append(parsed.alias(c))
+    return frame.with_columns(casts)
+
+
+def join_metadata(frame, tab_paths, columns, name_col="name", names=None, numeric=True):
+    """
+    Add CSD fields from ``.tab`` files to an embedding frame by REFCODE.
+
+    The tables are scanned lazily, reduced to ``REFCODE`` and ``columns``
+    and hash-joined on the REFCODE parsed from the fragment ids, so every
+    fragment of an entry gets that entry's values. Colour a map by any
+    field with e.g. ``hue="_refine_ls_R_factor"``.
+
+    Parameters:
+    -----------
+    frame : polars.DataFrame
+        Embedding frame, e.g. ``ud.filter(pl.col("N") == 30)``
+    tab_paths : str or list of str
+        ``.tab`` files; the first occurrence of a REFCODE wins
+    columns : list of str
+        CSD fields to add, with or without brackets
+    name_col : str
+        Column with fragment ids (``REFCODE_FRAGNUM``)
+    names : array-like, optional
+        Fragment ids in row order, when ``frame`` has no ``name_col``,
+        e.g. the ``names`` of the distance ``.npz``
+    numeric : bool
+        Cast fields whose values are all numbers to Float64
+
+    Returns:
+    --------
+    polars.DataFrame
+        ``frame`` with the fields appended, in the original row order;
+        fragments without a table entry get nulls
+    """
+    if isinstance(tab_paths, str):
+        tab_paths = [tab_paths]
+    if names is not None:
+        frame = frame.with_columns(pl.Series(name_col, names, dtype=pl.String))
+    fields = [c.strip("[]") for c in columns]
+    # Exports of different searches may have different fields
+    table = pl.concat([scan_tab(p, columns, strict=False) for p in tab_paths], how="diagonal")
+    missing = set(fields).difference(table.collect_schema().names())
+    if missing:
+        raise KeyError(f"No .tab file has columns {sorted(missing)}")
+    table = table.unique("REFCODE", keep="first", maintain_order=True).select(["REFCODE", *fields])
+
+    key = "__refcode"
+    result = (
+        frame.lazy()
+        .with_columns(refcode(name_col).alias(key))
+        .join(table.rename({"REFCODE": key}), on=key, how="left", maintain_order="left")
+        .drop(key)
+        .collect()
+    )
+    return _numeric(result, fields) if numeric else result
+
+
+def membership_labels(frame, groups, default=None, name_col="name"):
+    """
+    Label rows by which id set their fragment belongs to, in one pass.
+
+    Vectorized form of loops like ``if frag.id in cor1_sample_names`` in
+    f_all.ipynb; ``groups`` maps a label to fragment ids and the first
+    matching group wins.
+    """
+    expr = pl.lit(default, dtype=pl.String)
+    for label, ids in reversed(list(groups.items())):
+        member = pl.col(name_col).is_in(pl.Series(list(ids), dtype=pl.String))
+        expr = pl.when(member).then(pl.lit(label)).otherwise(expr)
+    return frame.select(expr.alias("group")).to_series()
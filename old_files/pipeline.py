@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def _hash_file(path, chunk_size=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Pipeline:
+    """
+    Content-addressed cache for the distances -> umaps -> labels workflow.
+
+    Every stage's artifacts live in ``<cache_dir>/<stage>/<key>/``, where
+    the key hashes the stage parameters together with the keys of its
+    inputs: the contents of the .cor file for ``distances``, the
+    upstream stage keys after that. A stage whose key already exists is
+    not run again, so changing e.g. the ``N`` list reruns ``umaps`` and
+    ``labels`` but not ``distances``, and an unchanged run only hashes
+    the inputs (cached by size and mtime).
+
+    Parameters:
+    -----------
+    cache_dir : str
+        Root of the artifact store
+    verbose : bool
+        Print one line per stage, computed or cached
+    """
+
+    def __init__(self, cache_dir=".rmsd_cache", verbose=True):
+        self.cache_dir = cache_dir
+        self.verbose = verbose
+        self._digests_path = os.path.join(cache_dir, "digests.json")
+        self._digests = _load_json(self._digests_path)
+        # Files linked out of the cache by publish, to know which are ours to replace
+        self._published_path = os.path.join(cache_dir, "published.json")
+        self._published = _load_json(self._published_path)
+
+    def file_digest(self, path):
+        """Content hash of a file, recomputed only when its size or mtime change."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        known = self._digests.get(path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = _hash_file(path)
+        self._digests[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        _save_json(self._digests_path, self._digests)
+        return digest
+
+    def _stage(self, stage, params, inputs, build, label=""):
+        """Directory of a stage's artifacts, running ``build(tmp_dir)`` on a miss."""
+        spec = json.dumps({"stage": stage, "params": params, "inputs": inputs}, sort_keys=True, default=str)
+        key = hashlib.blake2b(spec.encode(), digest_size=16).hexdigest()
+        path = os.path.join(self.cache_dir, stage, key)
+        if os.path.exists(os.path.join(path, "stage.json")):
+            if self.verbose:
+                print(f"{stage:9s} {label} cached ({key[:8]})")
+            return key, path
+
+        t0 = time.perf_counter()
+        tmp = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            build(tmp)
+            with open(os.path.join(tmp, "stage.json"), "w") as f:
+                f.write(spec)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp, path)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        if self.verbose:
+            print(f"{stage:9s} {label} computed in {time.perf_counter() - t0:.1f} s ({key[:8]})")
+        return key, path
+
+    def distances(self, cor_path, kind=None, engine="rmsd-map", permutations=None, reflection=True):
+        """
+        RMSD matrix of a .cor file as ``distances.npz`` (``names``, ``distances``).
+
+        ``engine="rmsd-map"`` runs ``rmsd-map-distances [-k kind]``; ``kind``
+        is passed through and means whatever rmsd-map defines it to.
+
+        ``engine="batched"`` uses ``distances.rmsd_matrix`` on float64
+        coordinates of same-size fragments. It does not interpret
+        ``kind``: the atom ``permutations`` minimized over and
+        ``reflection`` must be given explicitly, and only a run with the
+        same symmetry as rmsd-map reproduces its matrix. For the hexane
+        chain, ``[arange(6), arange(6)[::-1]]`` with ``reflection=True``
+        matches ``conformer/hexanes_rwp5_constr.npz`` (computed without
+        ``-k``) to 8e-4; pass the identity alone for fragments without
+        equivalent atom orderings.
+        """
+        params = {"kind": kind, "engine": engine}
+        if engine == "batched":
+            if kind is not None:
+                raise ValueError("kind applies to the rmsd-map engine; give the batched engine "
+                                 "permutations and reflection instead")
+            if permutations is None:
+                raise ValueError("the batched engine needs the atom permutations rmsd-map-distances "
+                                 "minimizes over, e.g. [0..5] and [5..0] for hexanes; without them "
+                                 "it computes a different matrix")
+            permutations = [np.asarray(p, dtype=np.int64) for p in permutations]
+            params.update(permutations=[p.tolist() for p in permutations], reflection=bool(reflection))
+
+        def build(out):
+            if engine == "rmsd-map":
+                cmd = ["rmsd-map-distances", "-o", os.path.join(out, "distances")]
+                if kind is not None:
+                    cmd += ["-k", kind]
+                subprocess.run(cmd + [os.path.abspath(cor_path)], check=True)
+            elif engine == "batched":
+                from cor_io import read_cor_coords
+                from distances import rmsd_matrix
+
+                names, coords = read_cor_coords(cor_path)
+                if any(len(p) != coords.shape[1] for p in permutations):
+                    raise ValueError(f"{cor_path}: permutations must have {coords.shape[1]} atoms")
+                matrix = rmsd_matrix(coords, permutations, reflection=reflection)
+                np.savez(os.path.join(out, "distances.npz"), names=names, distances=matrix)
+            else:
+                raise ValueError(f"Unknown distance engine {engine!r}")
+
+        key, path = self._stage("distances", params, [self.file_digest(cor_path)], build, cor_path)
+        return key, os.path.join(path, "distances.npz")
+
+    def umaps(self, distances, n_neighbors=(10, 20, 30, 40), densmap=(False, True), format="parquet",
+              processes=None, **umap_kwargs):
+        """UMAP embeddings of a ``distances`` stage via ``umaps.umap_sweep``."""
+        from umaps import _SUFFIXES
+
+        dist_key, npz_path = distances
+        params = {"n_neighbors": sorted(n_neighbors), "densmap": list(densmap), "format": format,
+                  "umap": umap_kwargs}
+
+        def build(out):
+            from umaps import umap_sweep
+
+            umap_sweep(npz_path, n_neighbors, densmap, os.path.join(out, "umaps"), processes=processes,
+                       format=format, **umap_kwargs)
+
+        key, path = self._stage("umaps", params, [dist_key], build, f"N={sorted(n_neighbors)}")
+        suffix = _SUFFIXES[format]
+        return key, {d: os.path.join(path, "umaps" + ("_d" if d else "") + suffix) for d in densmap}
+
+    def labels(self, umaps, n, densmap=True, min_cluster_size=15, min_samples=None, cluster_selection_epsilon=0.0):
+        """HDBSCAN labels of one ``N`` of a ``umaps`` stage, saved as ``labels.npy``."""
+        import polars as pl
+
+        umap_key, paths = umaps
+        params = {"N": n, "densmap": densmap, "min_cluster_size": min_cluster_size, "min_samples": min_samples,
+                  "cluster_selection_epsilon": cluster_selection_epsilon}
+
+        def build(out):
+            from clusters import HDBSCANCache
+            from umaps import scan_umaps
+
+            df = scan_umaps(paths[densmap]).filter(pl.col("N") == n).collect()
+            cache = HDBSCANCache(os.path.join(self.cache_dir, "hdbscan"))
+            labels = cache.labels(df.select(pl.col("X", "Y")).to_numpy(), min_cluster_size, min_samples,
+                                  cluster_selection_epsilon)
+            np.save(os.path.join(out, "labels.npy"), labels)
+
+        key, path = self._stage("labels", params, [umap_key], build, f"N={n}")
+        return key, os.path.join(path, "labels.npy")
+
+    def run(self, cor_path, kind=None, engine="rmsd-map", n_neighbors=(10, 20, 30, 40), densmap=(False, True),
+            format="parquet", cluster=None, publish=False, name=None, permutations=None, reflection=True,
+            **umap_kwargs):
+        """
+        All stages for one .cor file.
+
+        Parameters:
+        -----------
+        kind, engine, permutations, reflection
+            As in ``distances``
+        cluster : dict, optional
+            Arguments of ``labels`` (``n``, ``min_cluster_size``, ...);
+            clustering is skipped if not given
+        publish : bool
+            Also link the artifacts next to the .cor as ``<name>[_kind].npz``,
+            ``<name>_umaps[_d][_kind].<fmt>`` and ``<name>_labels[_kind].npy``,
+            the naming of the notebooks (e.g. ``no2cl_constr_umaps_d_proper``
+            with ``format="csv"``). Existing files are only replaced if an
+            earlier publish created them; anything else raises
+            ``FileExistsError``
+        name : str, optional
+            Dataset name for published files; the .cor stem by default
+
+        Returns:
+        --------
+        dict
+            Artifact paths in the cache
+        """
+        dist = self.distances(cor_path, kind, engine, permutations, reflection)
+        umaps = self.umaps(dist, n_neighbors, densmap, format, **umap_kwargs)
+        artifacts = {"distances": dist[1], **{("umaps_d" if d else "umaps"): p for d, p in umaps[1].items()}}
+        if cluster is not None:
+            artifacts["labels"] = self.labels(umaps, **cluster)[1]
+
+        if publish:
+            base = os.path.join(os.path.dirname(cor_path), name or os.path.splitext(os.path.basename(cor_path))[0])
+            suffix = f"_{kind}" if kind is not None else ""
+            for artifact, path in artifacts.items():
+                ext = os.path.splitext(path)[1]
+                middle = "" if artifact == "distances" else f"_{artifact}"
+                self.publish(path, f"{base}{middle}{suffix}{ext}")
+        return artifacts
+
+    def publish(self, source, target):
+        """
+        Hard-link a cached artifact to ``target``, copying across devices.
+
+        An existing ``target`` is replaced only if it is the file an earlier
+        ``publish`` put there, unchanged since; tracked results such as
+        ``conformer/hexanes_rwp5_constr.npz`` are never overwritten.
+        """
+        target = os.path.abspath(target)
+        if os.path.exists(target):
+            if os.path.samefile(source, target):
+                return
+            if self._published.get(target) != _file_id(target):
+                raise FileExistsError(f"{target} exists and was not published from {self.cache_dir}; "
+                                      "remove it or publish under another name")
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+        self._published[target] = _file_id(target)
+        _save_json(self._published_path, self._published)
+
+
+def _file_id(path):
+    stat = os.stat(path)
+    return [stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_json(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cached rmsd-map distances -> umaps -> labels for .cor files")
+    parser.add_argument("cor", nargs="+", help="input .cor files, e.g. conformer/hexanes_rwp5_constr.cor")
+    parser.add_argument("-k", "--kind", help="rmsd-map-distances kind, e.g. proper (rmsd-map engine only)")
+    parser.add_argument("-e", "--engine", default="rmsd-map", choices=["rmsd-map", "batched"])
+    parser.add_argument("-p", "--permutation", action="append",
+                        type=lambda s: [int(i) for i in s.split(",")],
+                        help="atom order to minimize over, batched engine only and required there; "
+                             "repeat for each, e.g. -p 0,1,2,3,4,5 -p 5,4,3,2,1,0")
+    parser.add_argument("--no-reflection", action="store_true", help="batched engine: proper rotations only")
+    parser.add_argument("-n", "--n-neighbors", type=int, nargs="+", default=[10, 20, 30, 40])
+    parser.add_argument("-d", "--densmap-only", action="store_true", help="skip the vanilla UMAP")
+    parser.add_argument("-f", "--format", default="parquet", choices=["csv", "parquet", "ipc"])
+    parser.add_argument("--cluster-n", type=int, help="cluster the densMAP embedding at this N with HDBSCAN")
+    parser.add_argument("--min-cluster-size", type=int, default=15)
+    parser.add_argument("--min-samples", type=int, help="defaults to --min-cluster-size")
+    parser.add_argument("--epsilon", type=float, default=0.0)
+    parser.add_argument("--cache", default=".rmsd_cache")
+    parser.add_argument("--publish", action="store_true",
+                        help="link the results next to each .cor; never replaces files it did not publish")
+    parser.add_argument("--name", help="dataset name of published files, e.g. no2cl_constr (one .cor only)")
+    parser.add_argument("-j", "--processes", type=int)
+    args = parser.parse_args()
+    if args.name is not None and len(args.cor) > 1:
+        parser.error("--name needs a single .cor file")
+
+    pipeline = Pipeline(args.cache)
+    cluster = None
+    if args.cluster_n is not None:
+        cluster = {"n": args.cluster_n, "min_cluster_size": args.min_cluster_size, "min_samples": args.min_samples,
+                   "cluster_selection_epsilon": args.epsilon}
+    densmap = (True,) if args.densmap_only else (False, True)
+    for cor in args.cor:
+        try:
+            pipeline.run(cor, args.kind, args.engine, args.n_neighbors, densmap, args.format, cluster,
+                         publish=args.publish, name=args.name, permutations=args.permutation,
+                         reflection=not args.no_reflection, processes=args.processes)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            print(f"{cor}: {e}", file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+import copy
+import multiprocessing
+import os
+import pickle
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from distances import knn_from_distances, knn_to_sparse
+
+
+def _model_path(models, n_neighbors, densmap):
+    return os.path.join(models, f"umap_N{n_neighbors}{'_d' if densmap else ''}.pkl")
+
+
+def load_model(models, n_neighbors, densmap=False):
+    """Fitted ``umap.UMAP`` saved by ``umap_sweep(..., models=...)``."""
+    with open(_model_path(models, n_neighbors, densmap), "rb") as f:
+        return pickle.load(f)
+
+
+def _fit(knn_indices, knn_dists, n_neighbors, densmap, umap_kwargs):
+    import umap
+
+    idx = np.ascontiguousarray(knn_indices[:, :n_neighbors])
+    dists = np.ascontiguousarray(knn_dists[:, :n_neighbors])
+    with warnings.catch_warnings():
+        # "inverse_transform will be unavailable" and friends
+        warnings.simplefilter("ignore", UserWarning)
+        reducer = umap.UMAP(
+            n_neighbors=n_neighbors,
+            metric="precomputed",
+            precomputed_knn=(idx, dists, None),
+            densmap=densmap,
+            **umap_kwargs,
+        )
+        reducer.fit(knn_to_sparse(idx, dists))
+    return reducer
+
+
+def _embed(knn_indices, knn_dists, n_neighbors, densmap, umap_kwargs, models=None):
+    # Runs in a worker process
+    reducer = _fit(knn_indices, knn_dists, n_neighbors, densmap, umap_kwargs)
+    if models is not None:
+        with open(_model_path(models, n_neighbors, densmap), "wb") as f:
+            pickle.dump(reducer, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return reducer.embedding_
+
+
+def _transform(reducer, knn_indices, knn_dists):
+    """``reducer.transform`` of new points given their kNN among the fitted ones."""
+    import scipy.sparse as sp
+
+    n, k = knn_indices.shape
+    query = sp.csr_matrix(
+        (knn_dists.ravel(), knn_indices.ravel(), np.arange(0, n * k + 1, k)),
+        shape=(n, reducer.embedding_.shape[0]),
+    )
+    if reducer.densmap:
+        reducer = copy.copy(reducer)
+        reducer.densmap = False
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return reducer.transform(query)
+
+
+def _frame(embeddings, n_values, names=None, dataset=None):
+    import polars as pl
+
+    n = len(embeddings[0])
+    columns = {
+        "X": np.concatenate([e[:, 0] for e in embeddings]).astype(np.float64),
+        "Y": np.concatenate([e[:, 1] for e in embeddings]).astype(np.float64),
+        "N": np.repeat(np.asarray(n_values, dtype=np.int64), n),
+    }
+    if names is not None:
+        columns["name"] = np.tile(np.asarray(names, dtype=str), len(embeddings))
+    if dataset is not None:
+        dataset = np.broadcast_to(np.asarray(dataset, dtype=str), (n,))
+        columns["dataset"] = np.tile(dataset, len(embeddings))
+    return pl.DataFrame(columns)
+
+
+_SUFFIXES = {"csv": ".csv", "parquet": ".parquet", "ipc": ".arrow"}
+
+
+def write_umaps(frame, path):
+    """
+    Write a multi-N UMAP frame, choosing the format by suffix.
+
+    ``.parquet`` files get one row group per ``N`` (with min/max
+    statistics), so ``pl.scan_parquet(path).filter(pl.col("N") == k)``
+    reads a single row group. ``.arrow`` writes uncompressed Arrow IPC,
+    which Polars memory-maps. ``.csv`` keeps only the ``rmsd-map-umaps``
+    columns ``X``, ``Y`` and ``N``.
+    """
+    import polars as pl
+
+    frame = frame.sort("N", maintain_order=True)
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for part in frame.partition_by("N", maintain_order=True):
+                table = part.to_arrow()
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+                writer.write_table(table, row_group_size=len(part))
+        finally:
+            if writer is not None:
+                writer.close()
+    elif path.endswith((".arrow", ".ipc", ".feather")):
+        frame.write_ipc(path, compression="uncompressed")
+    elif path.endswith(".csv"):
+        frame.select(pl.col("X", "Y", "N")).write_csv(path)
+    else:
+        raise ValueError(f"Unknown UMAP output format: {path}")
+
+
+def scan_umaps(path):
+    """
+    Lazy frame of a UMAP output written by ``write_umaps`` or ``rmsd-map-umaps``.
+
+    ``path`` may omit the suffix: ``"./hexanes_rwp5_constr_umaps_d"``
+    opens the ``.parquet``, ``.arrow`` or ``.csv`` file, whichever exists
+    first. Filter on ``N`` before ``collect()`` to read one embedding.
+    """
+    import polars as pl
+
+    if os.path.splitext(path)[1] not in (".parquet", ".arrow", ".ipc", ".feather", ".csv"):
+        for suffix in (".parquet", ".arrow", ".csv"):
+            if os.path.exists(path + suffix):
+                path += suffix
+                break
+    if path.endswith(".parquet"):
+        return pl.scan_parquet(path)
+    if path.endswith((".arrow", ".ipc", ".feather")):
+        return pl.scan_ipc(path)
+    return pl.scan_csv(path)
+
+
+def umap_sweep(distances, n_neighbors=(10, 20, 30, 40), densmap=(False, True), out_path=None,
+               processes=None, knn=None, format="csv", names=None, dataset=None, models=None,
+               **umap_kwargs):
+    """
+    UMAP embeddings for several ``N`` from a single neighbour search.
+
+    The kNN graph is computed once at ``max(n_neighbors)``; since rows are
+    sorted nearest first, its first ``N`` columns are exactly the graph
+    for every smaller ``N``. All (N, densMAP) embeddings then run in a
+    process pool, replacing one ``rmsd-map-umaps`` call per variant.
+
+    Parameters:
+    -----------
+    distances : array-like or str
+        Square distance matrix (a memmap is fine), or an ``.npz`` with
+        ``distances`` as written by ``rmsd-map-distances``
+    n_neighbors : sequence of int
+        Values of ``N`` to embed
+    densmap : sequence of bool
+        Variants to run; ``(False, True)`` gives vanilla UMAP and densMAP
+    out_path : str, optional
+        Writes ``<out>.csv`` (vanilla) and ``<out>_d.csv`` (densMAP), or
+        the same names with the suffix of ``format``
+    processes : int, optional
+        Number of worker processes; 1 runs everything in this process
+    knn : tuple, optional
+        Precomputed ``(knn_indices, knn_dists)`` with at least
+        ``max(n_neighbors)`` columns, e.g. from ``rmsd_knn_graph``
+    format : str
+        ``"csv"`` (``rmsd-map-umaps`` layout), ``"parquet"`` or ``"ipc"``,
+        see ``write_umaps``
+    names : array-like, optional
+        Fragment names for a ``name`` column; read from the ``.npz`` if
+        ``distances`` is a path
+    dataset : str or array-like, optional
+        Dataset key for a ``dataset`` column, one value or one per fragment
+    models : str, optional
+        Directory to pickle every fitted model into, for ``project_fragments``
+    **umap_kwargs
+        Passed to ``umap.UMAP`` (``min_dist``, ``random_state``, ...)
+
+    Returns:
+    --------
+    dict
+        densMAP flag -> polars.DataFrame with ``X``, ``Y`` and ``N`` columns,
+        plus ``name`` and ``dataset`` when known
+    """
+    n_neighbors = sorted(n_neighbors)
+    if isinstance(distances, str):
+        with np.load(distances) as data:
+            if names is None:
+                names = data["names"]
+            if knn is None:
+                distances = data["distances"]
+    if knn is None:
+        knn = knn_from_distances(distances, n_neighbors[-1])
+    knn_indices, knn_dists = knn
+    if knn_indices.shape[1] < n_neighbors[-1]:
+        raise ValueError(f"kNN graph has {knn_indices.shape[1]} columns, N={n_neighbors[-1]} requested")
+
+    if models is not None:
+        os.makedirs(models, exist_ok=True)
+    tasks = [(n, dens) for dens in densmap for n in n_neighbors]
+    if processes == 1:
+        results = [_embed(knn_indices, knn_dists, n, dens, umap_kwargs, models) for n, dens in tasks]
+    else:
+        # spawn, not fork: forking after numba started its threading layer
+        # (the UMAP fits themselves) leaves the workers or the parent hanging
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(_embed, knn_indices, knn_dists, n, dens, umap_kwargs, models) for n, dens in tasks
+            ]
+            results = [future.result() for future in futures]
+
+    frames = {}
+    for dens in densmap:
+        embeddings = [e for (n, d), e in zip(tasks, results) if d == dens]
+        frames[dens] = _frame(embeddings, n_neighbors, names, dataset)
+        if out_path is not None:
+            write_umaps(frames[dens], out_path + ("_d" if dens else "") + _SUFFIXES[format])
+    return frames
+
+
+def project_fragments(reducer, coords, ref_coords, oversample=8, permutations=None, reflection=True):
+    """
+    Place new fragments into an existing embedding without refitting it.
+
+    RMSD is computed only from the new fragments to their fingerprint
+    candidates in the reference set (``rmsd_query_knn``) and passed to
+    ``reducer.transform`` as a sparse precomputed matrix, so the existing
+    coordinates, cluster labels and line picks stay valid. UMAP has no
+    densMAP transform; densMAP models are projected with the vanilla
+    objective against their fixed layout.
+
+    Parameters:
+    -----------
+    reducer : umap.UMAP
+        Fitted model, e.g. from ``load_model``
+    coords : np.ndarray
+        (n_new, n_atoms, 3) stacked coordinates of the new fragments
+    ref_coords : np.ndarray
+        Stacked coordinates of the fragments the model was fitted on, in
+        the same order
+    oversample, permutations, reflection
+        As in ``rmsd_query_knn``
+
+    Returns:
+    --------
+    np.ndarray
+        (n_new, 2) embedding coordinates
+    """
+    from distances import rmsd_query_knn
+
+    n_ref = len(ref_coords)
+    if reducer.embedding_.shape[0] != n_ref:
+        raise ValueError(f"Model was fitted on {reducer.embedding_.shape[0]} fragments, got {n_ref}")
+    idx, dists = rmsd_query_knn(coords, ref_coords, reducer.n_neighbors, oversample, permutations, reflection)
+    return _transform(reducer, idx, dists)
+
+
+def extend_umaps(path, models, coords, ref_coords, names=None, dataset=None, densmap=False, **kwargs):
+    """
+    Append projections of new fragments to a stored multi-N UMAP output.
+
+    Every ``N`` in the file is projected with its saved model and the new
+    rows are written after the existing ones, so the file stays aligned
+    with the reference .cor followed by the new one.
+
+    Parameters:
+    -----------
+    path : str
+        Output of ``umap_sweep``/``write_umaps``; the suffix may be omitted
+    models : str
+        Model directory passed to ``umap_sweep``
+    coords, ref_coords : np.ndarray
+        Stacked coordinates of the new and reference fragments
+    names, dataset
+        Values for the ``name`` and ``dataset`` columns of the new rows,
+        if the file has them
+    densmap : bool
+        Whether ``path`` holds densMAP embeddings
+    **kwargs
+        Passed to ``project_fragments``
+
+    Returns:
+    --------
+    polars.DataFrame
+        The extended frame, also written back to ``path``
+    """
+    import polars as pl
+
+    lazy = scan_umaps(path)
+    path = next(path + s for s in ("", ".parquet", ".arrow", ".csv") if os.path.isfile(path + s))
+    frame = lazy.collect()
+    n_values = frame["N"].unique(maintain_order=True).to_list()
+    embeddings = [project_fragments(load_model(models, n, densmap), coords, ref_coords, **kwargs) for n in n_values]
+    new = _frame(
+        embeddings,
+        n_values,
+        names if "name" in frame.columns else None,
+        dataset if "dataset" in frame.columns else None,
+    )
+    frame = pl.concat([frame, new.select(frame.columns)])
+    # Write next to the original and swap, the old file may still be mapped
+    tmp = os.path.join(os.path.dirname(path), ".tmp-" + os.path.basename(path))
+    write_umaps(frame, tmp)
+    os.replace(tmp, path)
+    return frame.sort("N", maintain_order=True)
+
+
+def landmark_umap(coords, n_landmarks, n_neighbors=30, densmap=False, permutations=None, reflection=True,
+                  seed=None, **umap_kwargs):
+    """
+    Approximate UMAP of a large set from an RMSD block to M landmarks.
+
+    Landmarks are picked by farthest-point sampling
+    (``farthest_point_landmarks``), which also yields the (n, M) RMSD
+    block. UMAP is fitted on the landmarks alone; every other fragment is
+    placed from its ``n_neighbors`` nearest landmarks with
+    ``transform``, which starts from the weighted average of their
+    positions. Cost is n * M RMSD evaluations instead of n^2 / 2.
+
+    Parameters:
+    -----------
+    coords : np.ndarray
+        (n_fragments, n_atoms, 3) stacked coordinates
+    n_landmarks : int
+        Number of landmarks M; see ``landmark_report`` for choosing it
+    n_neighbors : int
+        UMAP ``N`` for the landmark graph and the placement
+    densmap : bool
+        Fit densMAP on the landmarks
+    permutations, reflection, seed
+        As in ``farthest_point_landmarks``
+    **umap_kwargs
+        Passed to ``umap.UMAP``
+
+    Returns:
+    --------
+    embedding : np.ndarray
+        (n_fragments, 2) coordinates in the order of ``coords``
+    landmarks : np.ndarray
+        Landmark fragment indices
+    reducer : umap.UMAP
+        Model fitted on the landmarks
+    """
+    from distances import farthest_point_landmarks
+
+    landmarks, block = farthest_point_landmarks(coords, n_landmarks, permutations, reflection, seed)
+    square = block[landmarks].astype(np.float64)
+    square = (square + square.T) / 2
+    np.fill_diagonal(square, 0.0)
+    n_neighbors = min(n_neighbors, len(landmarks) - 1)
+    knn_indices, knn_dists = knn_from_distances(square, n_neighbors)
+    reducer = _fit(knn_indices, knn_dists, n_neighbors, densmap, umap_kwargs)
+
+    embedding = np.empty((len(coords), 2), dtype=np.float32)
+    embedding[landmarks] = reducer.embedding_
+    rest = np.setdiff1d(np.arange(len(coords)), landmarks)
+    if len(rest):
+        part = block[rest]
+        idx = np.argpartition(part, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        dists = np.take_along_axis(part, idx, axis=1)
+        order = np.argsort(dists, axis=1, kind="stable")
+        idx = np.take_along_axis(idx, order, axis=1)
+        embedding[rest] = _transform(reducer, idx, np.take_along_axis(dists, order, axis=1))
+    return embedding, landmarks, reducer
+
+
+def landmark_report(coords, n_landmarks, n_neighbors=30, n_sample=1000, permutations=None, reflection=True,
+                    seed=None, **umap_kwargs):
+    """
+    Trustworthiness of landmark embeddings against an exact one, per M.
+
+    A random subsample of ``n_sample`` fragments gets its exact all-pairs
+    RMSD matrix. The reference row embeds the subsample with exact UMAP;
+    each landmark row embeds the whole set with ``landmark_umap`` and is
+    scored on the same subsample. Trustworthiness (1 is best) measures
+    how many embedded neighbours are also RMSD neighbours.
+
+    Parameters:
+    -----------
+    coords : np.ndarray
+        (n_fragments, n_atoms, 3) stacked coordinates
+    n_landmarks : sequence of int
+        Values of M to try
+    n_neighbors : int
+        UMAP ``N``, also the neighbourhood size of the score
+    n_sample : int
+        Size of the exactly scored subsample
+    permutations, reflection, seed, **umap_kwargs
+        As in ``landmark_umap``
+
+    Returns:
+    --------
+    polars.DataFrame
+        ``method``, ``M``, ``trustworthiness`` and ``seconds`` per run
+    """
+    import time
+
+    import polars as pl
+    from sklearn.manifold import trustworthiness
+
+    from distances import _centered, pair_rmsd
+
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(len(coords), size=min(n_sample, len(coords)), replace=False))
+    i, j = np.triu_indices(len(sample), 1)
+    exact = np.zeros((len(sample), len(sample)))
+    exact[i, j] = pair_rmsd(_centered(coords[sample]), i, j, permutations, reflection)
+    exact += exact.T
+    k = min(n_neighbors, len(sample) // 2 - 1)
+
+    rows = []
+    t0 = time.perf_counter()
+    knn_indices, knn_dists = knn_from_distances(exact, n_neighbors)
+    reference = _fit(knn_indices, knn_dists, n_neighbors, False, umap_kwargs).embedding_
+    rows.append(("exact", len(sample), trustworthiness(exact, reference, n_neighbors=k, metric="precomputed"),
+                 time.perf_counter() - t0))
+    for m in n_landmarks:
+        t0 = time.perf_counter()
+        embedding, _, _ = landmark_umap(coords, m, n_neighbors, False, permutations, reflection, seed, **umap_kwargs)
+        elapsed = time.perf_counter() - t0
+        score = trustworthiness(exact, embedding[sample], n_neighbors=k, metric="precomputed")
+        rows.append(("landmark", m, score, elapsed))
+    return pl.DataFrame(rows, schema=["method", "M", "trustworthiness", "seconds"], orient="row")
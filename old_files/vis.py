@@ -5,13 +5,23 @@ import traitlets
 from shapely.geometry import Point, LineString
 import numpy as np
 
+from raster import label_palette
+
 
 class ChooseLineWidget(anywidget.AnyWidget):
     # Traitlets for bidirectional communication
-    data = traitlets.List([]).tag(sync=True)
+    # Coordinates as raw little-endian float32 buffers (binary, not JSON)
+    x = traitlets.Bytes(b"").tag(sync=True)
+    y = traitlets.Bytes(b"").tag(sync=True)
     x_col = traitlets.Unicode("x").tag(sync=True)
     y_col = traitlets.Unicode("y").tag(sync=True)
     line_points = traitlets.List([]).tag(sync=True)  # In DATA coordinates
+    # Optional per-point label codes (uint16 buffer) indexing label_values/colors
+    labels = traitlets.Bytes(b"").tag(sync=True)
+    label_values = traitlets.List([]).tag(sync=True)
+    colors = traitlets.List([]).tag(sync=True)
+    # Labels shown in the browser; empty means all points are shown
+    selected_labels = traitlets.List([]).tag(sync=True)
 
     _esm = """
     async function render({ model, el }) {
@@ -23,8 +33,29 @@ class ChooseLineWidget(anywidget.AnyWidget):
       const height = 400;
       const margin = { top: 20, right: 20, bottom: 50, left: 60 };
 
+      // Cluster legend; clicking a label toggles it in the selection
+      const legend = d3.select(el)
+        .append("div")
+        .attr("class", "choose-line-legend");
+
+      // Stack a canvas point layer under the SVG (axes and polyline)
+      const container = d3.select(el)
+        .append("div")
+        .attr("class", "choose-line")
+        .style("width", `${width}px`)
+        .style("height", `${height}px`);
+
+      const dpr = window.devicePixelRatio || 1;
+      const canvas = container.append("canvas")
+        .attr("width", Math.round(width * dpr))
+        .attr("height", Math.round(height * dpr))
+        .style("width", `${width}px`)
+        .style("height", `${height}px`)
+        .node();
+      const ctx = canvas.getContext("2d");
+
       // Create SVG
-      const svg = d3.select(el)
+      const svg = container
         .append("svg")
         .attr("width", width)
         .attr("height", height);
@@ -32,14 +63,59 @@ class ChooseLineWidget(anywidget.AnyWidget):
       // Create main group for zoomable content
       const g = svg.append("g");
 
-      // Get data and column names from Python
-      const data = model.get("data");
+      // Get coordinate buffers and column names from Python
+      function asTyped(view, ArrayType) {
+        const size = ArrayType.BYTES_PER_ELEMENT;
+        if (view instanceof ArrayBuffer) return new ArrayType(view);
+        if (view.byteOffset % size !== 0) {
+          // Typed arrays need an aligned offset; copy misaligned buffers
+          return new ArrayType(view.buffer.slice(view.byteOffset, view.byteOffset + view.byteLength));
+        }
+        return new ArrayType(view.buffer, view.byteOffset, view.byteLength / size);
+      }
+      const xValues = asTyped(model.get("x"), Float32Array);
+      const yValues = asTyped(model.get("y"), Float32Array);
       const xCol = model.get("x_col");
       const yCol = model.get("y_col");
 
-      // Extract x and y values
-      const xValues = data.map(d => d[xCol]);
-      const yValues = data.map(d => d[yCol]);
+      // Label codes, or a single implicit label when none were given
+      const labelView = model.get("labels");
+      const hasLabels = labelView && labelView.byteLength > 0;
+      const codes = hasLabels ? asTyped(labelView, Uint16Array) : new Uint16Array(xValues.length);
+      const labelValues = hasLabels ? model.get("label_values") : [null];
+      const colors = hasLabels ? model.get("colors") : ["steelblue"];
+      const rgb = colors.map(c => d3.rgb(c));
+
+      // active[code] is 1 for labels currently shown
+      const active = new Uint8Array(labelValues.length);
+      function updateActive() {
+        const selected = model.get("selected_labels") || [];
+        const keys = new Set(selected.map(String));
+        labelValues.forEach((v, code) => {
+          active[code] = selected.length === 0 || keys.has(String(v)) ? 1 : 0;
+        });
+        legend.selectAll(".chip").classed("off", (v, code) => !active[code]);
+      }
+
+      if (hasLabels) {
+        legend.selectAll(".chip")
+          .data(labelValues)
+          .join("span")
+          .attr("class", "chip")
+          .style("border-color", (v, code) => colors[code])
+          .text(v => v)
+          .on("click", (event, v) => {
+            const keys = new Set((model.get("selected_labels") || []).map(String));
+            if (keys.has(String(v))) keys.delete(String(v)); else keys.add(String(v));
+            // Sync back label values, not point indices
+            const selected = labelValues.filter(u => keys.has(String(u)));
+            model.set("selected_labels", selected);
+            model.save_changes();
+            updateActive();
+            requestDraw();
+          });
+      }
+      updateActive();
 
       // Create scales with proper domains
       const xScale = d3.scaleLinear()
@@ -84,20 +160,124 @@ class ChooseLineWidget(anywidget.AnyWidget):
         .style("font-size", "12px")
         .text(yCol);
 
-      // Draw scatter points
-      g.selectAll("circle")
-        .data(data)
-        .join("circle")
-        .attr("cx", d => xScale(d[xCol]))
-        .attr("cy", d => yScale(d[yCol]))
-        .attr("r", 5)
-        .attr("fill", "steelblue")
-        .attr("opacity", 0.7);
+      // Draw scatter points on the canvas. Up to maxDirectPoints visible
+      // points are drawn as circles; beyond that (zoomed out) points are
+      // decimated to one pixel cell of lodCell px each, shaded by density.
+      const pointRadius = 3;
+      const maxDirectPoints = 20000;
+      const lodCell = 2;
+      const nPoints = xValues.length;
+      const px = new Float32Array(nPoints);
+      const py = new Float32Array(nPoints);
+      const pc = new Uint16Array(nPoints);
+
+      function drawPoints() {
+        ctx.setTransform(1, 0, 0, 1, 0, 0);
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+
+        // Linear scales: pixel = a * value + b
+        const ax = currentXScale(1) - currentXScale(0), bx = currentXScale(0);
+        const ay = currentYScale(1) - currentYScale(0), by = currentYScale(0);
+        let visible = 0;
+        for (let i = 0; i < nPoints; i++) {
+          if (!active[codes[i]]) continue;
+          const sx = ax * xValues[i] + bx;
+          const sy = ay * yValues[i] + by;
+          if (sx >= 0 && sx < width && sy >= 0 && sy < height) {
+            px[visible] = sx;
+            py[visible] = sy;
+            pc[visible] = codes[i];
+            visible++;
+          }
+        }
+
+        if (visible <= maxDirectPoints) {
+          ctx.setTransform(dpr, 0, 0, dpr, 0, 0);
+          ctx.globalAlpha = 0.7;
+          // One path per label colour
+          for (let code = 0; code < colors.length; code++) {
+            if (!active[code]) continue;
+            ctx.fillStyle = colors[code];
+            ctx.beginPath();
+            for (let i = 0; i < visible; i++) {
+              if (pc[i] !== code) continue;
+              ctx.moveTo(px[i] + pointRadius, py[i]);
+              ctx.arc(px[i], py[i], pointRadius, 0, 2 * Math.PI);
+            }
+            ctx.fill();
+          }
+          ctx.globalAlpha = 1;
+          return;
+        }
+
+        const cell = Math.max(1, Math.round(lodCell * dpr));
+        const gw = Math.ceil(canvas.width / cell);
+        const gh = Math.ceil(canvas.height / cell);
+        const counts = new Uint32Array(gw * gh);
+        const cellCode = new Uint16Array(gw * gh);
+        let maxCount = 0;
+        for (let i = 0; i < visible; i++) {
+          const k = ((py[i] * dpr / cell) | 0) * gw + ((px[i] * dpr / cell) | 0);
+          const c = ++counts[k];
+          cellCode[k] = pc[i];
+          if (c > maxCount) maxCount = c;
+        }
+
+        const image = ctx.createImageData(canvas.width, canvas.height);
+        const rgba = image.data;
+        const logMax = Math.log1p(maxCount);
+        for (let k = 0; k < counts.length; k++) {
+          if (counts[k] === 0) continue;
+          const alpha = Math.round(255 * (0.35 + 0.65 * Math.log1p(counts[k]) / logMax));
+          const x0 = (k % gw) * cell, y0 = Math.floor(k / gw) * cell;
+          const x1 = Math.min(x0 + cell, canvas.width), y1 = Math.min(y0 + cell, canvas.height);
+          const colour = rgb[cellCode[k]];
+          for (let y = y0; y < y1; y++) {
+            for (let x = x0; x < x1; x++) {
+              const o = 4 * (y * canvas.width + x);
+              rgba[o] = colour.r; rgba[o + 1] = colour.g; rgba[o + 2] = colour.b; rgba[o + 3] = alpha;
+            }
+          }
+        }
+        ctx.putImageData(image, 0, 0);
+      }
+
+      // Coalesce redraws to one per animation frame
+      let drawPending = false;
+      function requestDraw() {
+        if (drawPending) return;
+        drawPending = true;
+        requestAnimationFrame(() => {
+          drawPending = false;
+          drawPoints();
+        });
+      }
 
       // Array to store line points (in pixel coordinates for drawing)
       let linePointsPixels = [];
+      // Set while mirroring a locally appended vertex into the model
+      let skipLineChange = false;
       const lineGroup = g.append("g").attr("class", "line-group");
 
+      // Draw only the newest vertex and the segment leading to it
+      function appendLine() {
+        const n = linePointsPixels.length;
+        if (n >= 2) {
+          lineGroup.append("line")
+            .attr("x1", linePointsPixels[n - 2].x)
+            .attr("y1", linePointsPixels[n - 2].y)
+            .attr("x2", linePointsPixels[n - 1].x)
+            .attr("y2", linePointsPixels[n - 1].y)
+            .attr("stroke", "red")
+            .attr("stroke-width", 2);
+        }
+        lineGroup.append("circle")
+          .attr("cx", linePointsPixels[n - 1].x)
+          .attr("cy", linePointsPixels[n - 1].y)
+          .attr("r", 4)
+          .attr("fill", "red");
+      }
+
       // Function to update the polyline
       function updateLine() {
         lineGroup.selectAll("line").remove();
@@ -149,7 +329,7 @@ class ChooseLineWidget(anywidget.AnyWidget):
         .on("zoom", (event) => {
           const transform = event.transform;
 
-          // Update the plot elements
+          // Update the polyline layer
           g.attr("transform", transform);
 
           // Update scales for axes
@@ -159,9 +339,12 @@ class ChooseLineWidget(anywidget.AnyWidget):
           // Update axes
           xAxisGroup.call(xAxis.scale(currentXScale));
           yAxisGroup.call(yAxis.scale(currentYScale));
+
+          requestDraw();
         });
 
       svg.call(zoom);
+      drawPoints();
 
       // Click handler to add points to line
       svg.on("click", function(event) {
@@ -174,18 +357,19 @@ class ChooseLineWidget(anywidget.AnyWidget):
         const y = (mouseY - transform.y) / transform.k;
 
         // Store in pixel coordinates for drawing
-        linePointsPixels = [...linePointsPixels, { x: x, y: y }];
+        linePointsPixels.push({ x: x, y: y });
+        const point = pixelsToData(x, y);
 
-        // Convert all points to data coordinates for Python
-        const dataPoints = linePointsPixels.map(p =>
-          pixelsToData(p.x, p.y)
-        );
+        // Send only the new vertex to Python (in data coordinates)
+        model.send({ event: "append", point: point });
 
-        // Sync to Python (in data coordinates)
-        model.set("line_points", dataPoints);
-        model.save_changes();
+        // Mirror it in the local model state without syncing or redrawing;
+        // Python already has the vertex from the message
+        skipLineChange = true;
+        model.set("line_points", [...(model.get("line_points") || []), point]);
+        skipLineChange = false;
 
-        updateLine();
+        appendLine();
       });
 
       // Double-click to clear the line
@@ -207,6 +391,7 @@ class ChooseLineWidget(anywidget.AnyWidget):
 
       // Listen for changes from Python (convert data coords to pixels)
       model.on("change:line_points", () => {
+        if (skipLineChange) return;
         const dataPoints = model.get("line_points") || [];
         // Convert data coordinates to pixel coordinates
         linePointsPixels = dataPoints.map(p =>
@@ -215,6 +400,12 @@ class ChooseLineWidget(anywidget.AnyWidget):
         updateLine();  // CRITICAL: Call updateLine to redraw
       });
 
+      // Selection set from Python
+      model.on("change:selected_labels", () => {
+        updateActive();
+        requestDraw();
+      });
+
       // Initialize line from Python if present
       const initialDataPoints = model.get("line_points") || [];
       if (initialDataPoints.length > 0) {
@@ -229,11 +420,30 @@ class ChooseLineWidget(anywidget.AnyWidget):
     """
 
     _css = """
-    svg {
+    .choose-line {
+      position: relative;
       border: 1px solid #ccc;
       background-color: #fafafa;
+    }
+    .choose-line canvas, .choose-line svg {
+      position: absolute;
+      top: 0;
+      left: 0;
+    }
+    .choose-line svg {
       cursor: crosshair;
     }
+    .choose-line-legend .chip {
+      display: inline-block;
+      margin: 0 4px 4px 0;
+      padding: 0 6px;
+      border-left: 10px solid;
+      font-size: 11px;
+      cursor: pointer;
+    }
+    .choose-line-legend .chip.off {
+      opacity: 0.35;
+    }
     .x-axis line, .y-axis line {
       stroke: #666;
     }
@@ -246,40 +456,400 @@ class ChooseLineWidget(anywidget.AnyWidget):
     }
     """
 
-    def __init__(self, df=None, x_col="x", y_col="y", **kwargs):
+    def __init__(self, df=None, x_col="x", y_col="y", label_col=None, palette=None, **kwargs):
         """
-        Initialize widget with a Polars DataFrame.
+        Initialize widget with a Polars DataFrame or a NumPy array.
 
         Parameters:
         -----------
-        df : polars.DataFrame
-            The dataframe containing scatter plot data
+        df : polars.DataFrame or np.ndarray
+            The dataframe containing scatter plot data, or an (n, 2) array
         x_col : str
             Name of the column to use for x-axis
         y_col : str
             Name of the column to use for y-axis
+        label_col : str, optional
+            Column with cluster labels; points are coloured by it and can be
+            filtered by clicking the legend, without re-sending the data
+        palette : list of str, optional
+            Colours per label, in sorted label order; tab10 by default, with
+            the HDBSCAN/DBSCAN noise label -1 in grey
         """
         super().__init__(**kwargs)
 
+        self._points = np.zeros((0, 2))
+        self._index = None
+        self._codes = None
+        self._sorter = None
+        self._appending = False
+        self.on_msg(self._handle_msg)
         if df is not None:
-            # Convert Polars DataFrame to list of dicts for JSON serialization
-            self.data = df.select([x_col, y_col]).to_dicts()
+            # Columns go over the wire as binary float32 buffers
+            self._points = _xy_array(df, x_col, y_col)
+            self.x = self._points[:, 0].astype("<f4").tobytes()
+            self.y = self._points[:, 1].astype("<f4").tobytes()
             self.x_col = x_col
             self.y_col = y_col
+            if label_col is not None:
+                self._set_labels(df[label_col].to_numpy(), palette)
+
+    def _set_labels(self, labels, palette=None):
+        values, codes = np.unique(labels, return_inverse=True)
+        if len(values) > np.iinfo(np.uint16).max:
+            raise ValueError(f"Too many distinct labels: {len(values)}")
+        if palette is None:
+            palette = label_palette(values)
+        self._codes = codes.astype("<u2")
+        self.label_values = values.tolist()
+        self.colors = list(palette)
+        self.labels = self._codes.tobytes()
+
+    @property
+    def selected_mask(self):
+        """Boolean mask of points whose label is selected in the browser."""
+        if self._codes is None or not self.selected_labels:
+            return np.ones(len(self._points), dtype=bool)
+        keys = {_label_key(v) for v in self.selected_labels}
+        active = np.array([_label_key(v) in keys for v in self.label_values], dtype=bool)
+        return active[self._codes]
+
+    @property
+    def selected_indices(self):
+        """Row indices of the points with a selected label."""
+        return np.flatnonzero(self.selected_mask)
+
+    def _handle_msg(self, widget, content, buffers):
+        # The browser sends one {"event": "append", "point": {...}} per click
+        if content.get("event") != "append":
+            return
+        new = self.line_points + [content["point"]]
+        self._appending = True
+        try:
+            # The browser already has this state, so don't echo it back
+            with self._lock_property(line_points=new):
+                self.line_points = new
+        finally:
+            self._appending = False
+        if self._sorter is not None:
+            self._sorter.append(content["point"])
+
+    @traitlets.observe("line_points")
+    def _line_points_changed(self, change):
+        if not self._appending:
+            self._sorter = None
+
+    def sort_along(self, threshold=None):
+        """
+        Indices of the widget points ordered along the drawn line.
+
+        The spatial index is built on first call and reused, so re-drawing
+        the line only re-projects points inside the threshold corridor.
+        With a threshold the ordering is also kept up to date as vertices
+        are clicked, re-projecting only points near each new segment.
+        Indices refer to rows of the full frame; with labels selected in
+        the browser only points of those labels are returned.
+        """
+        if self._index is None:
+            self._index = PointGrid(self._points)
+        if threshold is None:
+            idx = sort_along(self.line_points, self._points, index=self._index)
+        else:
+            if self._sorter is None or self._sorter.threshold != threshold:
+                self._sorter = IncrementalSort(self._points, threshold, index=self._index)
+                self._sorter.extend(self.line_points)
+            idx = self._sorter.order
+        if self._codes is not None and self.selected_labels:
+            idx = idx[self.selected_mask[idx]]
+        return idx
+
+
+def _label_key(value):
+    # JavaScript has one number type: label 1.0 comes back from the browser as 1
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return float(value)
+    return str(value)
+
+
+def _xy_array(data, x_col="X", y_col="Y"):
+    """Return an (n, 2) float64 array of coordinates from a Polars frame or an array."""
+    if isinstance(data, np.ndarray):
+        return np.asarray(data[:, :2], dtype=np.float64)
+    # Column-wise Series.to_numpy avoids materializing rows
+    return np.column_stack([data[x_col].to_numpy(), data[y_col].to_numpy()]).astype(np.float64, copy=False)
+
+
+def _line_vertices(line_points):
+    """Convert widget line points (list of {"x", "y"} dicts) to an (m, 2) array."""
+    if isinstance(line_points, np.ndarray):
+        return np.asarray(line_points, dtype=np.float64)
+    return np.array([(d["x"], d["y"]) for d in line_points], dtype=np.float64).reshape(-1, 2)
+
+
+def project_onto_polyline(points, vertices, chunk_size=4096, start_offset=0.0, dtype="float32"):
+    """
+    Project points onto a polyline, vectorized over points and segments.
+
+    Equivalent to ``LineString.project`` and ``Point.distance`` from shapely,
+    computed for all points at once. Points are processed in chunks of
+    ``chunk_size`` so that the (chunk, segments) work arrays stay bounded.
+
+    Parameters:
+    -----------
+    points : np.ndarray
+        (n, 2) array of point coordinates
+    vertices : np.ndarray
+        (m, 2) array of polyline vertices; with m = 0 all distances are NaN
+    chunk_size : int
+        Number of points projected per batch
+    start_offset : float
+        Length of line preceding the first vertex, added to ``dists_along``
+    dtype : str
+        Output precision; the nearest segment is always chosen in float64
+
+    Returns:
+    --------
+    dists_along : np.ndarray
+        (n,) distance along the polyline to the nearest point on it
+    dists_from : np.ndarray
+        (n,) distance from each point to the polyline
+    """
+    points = np.asarray(points, dtype=np.float64)
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    if len(vertices) == 0:
+        # No line drawn yet: NaN positions, as shapely gives for an empty LineString
+        return np.full(len(points), np.nan, dtype=dtype), np.full(len(points), np.nan, dtype=dtype)
+    if len(vertices) == 1:
+        vertices = np.repeat(vertices, 2, axis=0)
+
+    starts = vertices[:-1]
+    segments = vertices[1:] - starts
+    seg_len2 = np.einsum("ij,ij->i", segments, segments)
+    seg_len = np.sqrt(seg_len2)
+    seg_offset = start_offset + np.concatenate([[0.0], np.cumsum(seg_len)[:-1]])
+    safe_len2 = np.where(seg_len2 > 0, seg_len2, 1.0)
+
+    n = len(points)
+    dists_along = np.zeros(n, dtype=dtype)
+    dists_from = np.zeros(n, dtype=dtype)
+    for lo in range(0, n, chunk_size):
+        chunk = points[lo:lo + chunk_size]
+        rows = np.arange(len(chunk))
+        rel = chunk[:, None, :] - starts[None, :, :]
+        t = np.clip(np.einsum("psk,sk->ps", rel, segments) / safe_len2, 0.0, 1.0)
+        diff = rel - t[:, :, None] * segments[None, :, :]
+        d2 = np.einsum("psk,psk->ps", diff, diff)
+        # argmin keeps the first of equally close segments, as shapely does
+        nearest = np.argmin(d2, axis=1)
+        dists_from[lo:lo + chunk_size] = np.sqrt(d2[rows, nearest])
+        dists_along[lo:lo + chunk_size] = seg_offset[nearest] + t[rows, nearest] * seg_len[nearest]
+    return dists_along, dists_from
+
+
+class PointGrid:
+    """
+    Uniform grid over 2D points for corridor queries around a polyline.
+
+    Points are bucketed by cell and stored sorted by cell key, so a query
+    only gathers the points of cells within ``radius`` of some segment.
+
+    Parameters:
+    -----------
+    points : np.ndarray
+        (n, 2) array of point coordinates
+    cell_size : float, optional
+        Grid cell edge; by default chosen to hold ~``per_cell`` points per cell
+    per_cell : int
+        Target mean number of points per cell for the default cell size
+    """
+
+    def __init__(self, points, cell_size=None, per_cell=8):
+        self.points = np.asarray(points, dtype=np.float64)
+        n = len(self.points)
+        if n == 0:
+            self.origin = np.zeros(2)
+            self.cell_size = 1.0
+            self.shape = (1, 1)
+            self.order = np.zeros(0, dtype=np.int64)
+            self.sorted_keys = np.zeros(0, dtype=np.int64)
+            return
+
+        self.origin = self.points.min(axis=0)
+        extent = np.maximum(self.points.max(axis=0) - self.origin, 1e-12)
+        if cell_size is None:
+            cell_size = np.sqrt(extent[0] * extent[1] * per_cell / n)
+            cell_size = max(cell_size, extent.max() / 4096)
+        self.cell_size = float(cell_size)
+        ij = self._cells(self.points)
+        self.shape = tuple(int(v) for v in ij.max(axis=0) + 1)
+        keys = ij[:, 0] * self.shape[1] + ij[:, 1]
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def _cells(self, xy):
+        return np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+
+    def query_polyline(self, vertices, radius):
+        """Sorted indices of all points that may lie within ``radius`` of the polyline."""
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+        if len(self.order) == 0 or len(vertices) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if len(vertices) == 1:
+            vertices = np.repeat(vertices, 2, axis=0)
+
+        # A cell can hold a point within radius only if its centre is within
+        # radius + half the cell diagonal of the segment
+        reach = radius + self.cell_size * np.sqrt(0.5)
+        nx, ny = self.shape
+        keys = []
+        for a, b in zip(vertices[:-1], vertices[1:]):
+            lo = np.maximum(self._cells(np.minimum(a, b) - radius), 0)
+            hi = np.minimum(self._cells(np.maximum(a, b) + radius), [nx - 1, ny - 1])
+            if np.any(hi < lo):
+                continue
+            ii, jj = np.meshgrid(np.arange(lo[0], hi[0] + 1), np.arange(lo[1], hi[1] + 1), indexing="ij")
+            ii, jj = ii.ravel(), jj.ravel()
+            centres = self.origin + (np.stack([ii, jj], axis=1) + 0.5) * self.cell_size
+            _, dist = project_onto_polyline(centres, np.stack([a, b]))
+            near = dist <= reach
+            keys.append(ii[near] * ny + jj[near])
+        if not keys:
+            return np.zeros(0, dtype=np.int64)
+        keys = np.unique(np.concatenate(keys))
+
+        starts = np.searchsorted(self.sorted_keys, keys, side="left")
+        counts = np.searchsorted(self.sorted_keys, keys, side="right") - starts
+        total = counts.sum()
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+        return np.sort(self.order[positions])
+
+
+def sort_along(line_points, data_df, threshold = None, x_col = "X", y_col = "Y", index = None):
+    """
+    Indices of points ordered by their projection along a polyline.
 
+    If ``threshold`` is given, only points closer than it to the line are
+    kept; with a ``PointGrid`` ``index`` built on the same points, only the
+    points in the threshold corridor are projected at all.
+    """
+    points = _xy_array(data_df, x_col, y_col)
+    vertices = _line_vertices(line_points)
+    if index is not None and threshold is not None:
+        candidates = index.query_polyline(vertices, threshold)
+        dists_along, dists_from = project_onto_polyline(points[candidates], vertices)
+        near = dists_from < threshold
+        candidates, dists_along = candidates[near], dists_along[near]
+        return candidates[np.argsort(dists_along, kind="stable")]
+
+    dists_along, dists_from = project_onto_polyline(points, vertices)
+    idx = np.argsort(dists_along, kind="stable")
+    if threshold is not None:
+        idx = idx[dists_from[idx] < threshold]
+    return idx
 
-def sort_along(line_points, data_df, threshold = None, x_col = "X", y_col = "Y"):
+
+class IncrementalSort:
+    """
+    ``sort_along`` with a threshold, updated one appended vertex at a time.
+
+    Keeps the best (distance from, distance along) per point over the
+    segments seen so far. Appending a vertex only projects the points in
+    the corridor of the new segment and re-sorts the near set, instead of
+    re-projecting every point onto the whole line.
+
+    Parameters:
+    -----------
+    points : np.ndarray
+        (n, 2) array of point coordinates
+    threshold : float
+        Maximal distance from the line for a point to be kept
+    index : PointGrid, optional
+        Spatial index over ``points``; built if not given
+    """
+
+    def __init__(self, points, threshold, index=None):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.threshold = threshold
+        self.index = index if index is not None else PointGrid(self.points)
+        # float64, so that segments are compared as sort_along's argmin does
+        self.dists_along = np.zeros(len(self.points))
+        self.dists_from = np.full(len(self.points), np.inf)
+        self.vertices = []
+        self.length = 0.0
+        self._near = np.zeros(0, dtype=np.int64)
+
+    @property
+    def order(self):
+        """Indices of points within threshold, ordered along the line."""
+        return self._near
+
+    def extend(self, line_points):
+        for point in line_points:
+            self.append(point)
+
+    def append(self, point):
+        vertex = _line_vertices([point])[0]
+        start = self.vertices[-1] if self.vertices else vertex
+        self.vertices.append(vertex)
+        segment = np.stack([start, vertex])
+
+        candidates = self.index.query_polyline(segment, self.threshold)
+        along, dist = project_onto_polyline(self.points[candidates], segment, start_offset=self.length,
+                                            dtype=np.float64)
+        # Summed like the cumulative segment offsets in project_onto_polyline
+        self.length += float(np.sqrt(np.dot(vertex - start, vertex - start)))
+        # Strict comparison keeps the earlier of equally close segments
+        better = dist < self.dists_from[candidates]
+        candidates = candidates[better]
+        self.dists_along[candidates] = along[better]
+        self.dists_from[candidates] = dist[better]
+
+        # sort_along thresholds and sorts the float32 distances
+        near = np.union1d(self._near, candidates[dist[better].astype("float32") < self.threshold])
+        # Same ordering as sort_along: by distance along, ties by index
+        self._near = near[np.lexsort((near, self.dists_along[near].astype("float32")))]
+
+
+def _project_shapely(points, line_points):
+    # Reference point-by-point implementation, kept for benchmarking
     polyline = LineString(  [ (d["x"], d["y"]) for  d in line_points])
-    n, _ = data_df.shape
+    n = len(points)
     dists_along = np.zeros(n, dtype= "float32")
     dists_from = np.zeros(n, dtype= "float32")
-    for i, d in enumerate(data_df.to_dicts()):
-        point = Point(d[x_col], d[y_col])
-        dist_along = polyline.project(point)
-        dist_from =  point.distance(polyline)
-        dists_along[i] = dist_along
-        dists_from[i] = dist_from
-    idx = np.argsort(dists_along)
-    if threshold is not None:
-        idx = idx[dists_from < threshold]
-    return idx
+    for i, (x, y) in enumerate(points):
+        point = Point(x, y)
+        dists_along[i] = polyline.project(point)
+        dists_from[i] = point.distance(polyline)
+    return dists_along, dists_from
+
+
+if __name__ == "__main__":
+    # Benchmark: vectorized projection vs the shapely point loop
+    import time
+
+    rng = np.random.default_rng(0)
+    # Hand-drawn-like line: 50 clicks in small steps
+    walk = np.cumsum(rng.normal(0, 0.2, size=(50, 2)), axis=0)
+    line = [{"x": x, "y": y} for x, y in walk]
+    for n in (10_000, 100_000):
+        pts = rng.uniform(-6, 6, size=(n, 2))
+        t0 = time.perf_counter()
+        ref_along, ref_from = _project_shapely(pts, line)
+        t1 = time.perf_counter()
+        along, dist = project_onto_polyline(pts, _line_vertices(line))
+        t2 = time.perf_counter()
+        print(f"n={n}: shapely {t1 - t0:.3f} s, vectorized {t2 - t1:.3f} s, "
+              f"max |d_along| {np.abs(along - ref_along).max():.2e}, "
+              f"max |d_from| {np.abs(dist - ref_from).max():.2e}")
+
+    # Corridor query through the grid index, as used by ChooseLineWidget
+    pts = rng.uniform(-6, 6, size=(500_000, 2))
+    t0 = time.perf_counter()
+    grid = PointGrid(pts)
+    t1 = time.perf_counter()
+    fast = sort_along(line, pts, 0.1, index=grid)
+    t2 = time.perf_counter()
+    full = sort_along(line, pts, 0.1)
+    t3 = time.perf_counter()
+    print(f"n=500000, threshold 0.1: index build {t1 - t0:.3f} s, "
+          f"indexed sort {t2 - t1:.3f} s, full sort {t3 - t2:.3f} s, "
+          f"identical: {np.array_equal(fast, full)}")